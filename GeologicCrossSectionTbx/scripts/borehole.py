@@ -20,6 +20,10 @@ import sys
 import math
 import traceback
 import arcpy
+import xsec_defs
+import xsec_dem
+import xsec_routes
+import xsec_transform
 
 # FUNCTIONS
 # ***************************************************************
@@ -42,29 +46,6 @@ def getCPValue(quadrant):
 
     return cpDict[quadrant]
 
-def addAndCalc(layer, field, calc):
-    #adds a field to a table (layer) of name (field), and calcs a value
-    #created as means to add an rkey value to line layers that consist
-    #of OID values
-    try:
-        #add a key field if it doesn't already exist
-        if len(arcpy.ListFields(layer, field)) ==0:
-            arcpy.AddField_management(layer, field, 'LONG')
-
-		#calculate the id value over to the new value so we always have it in the table
-		#as it goes through it's various transformations, some of which will re-write
-		#the id field.
-        arcpy.CalculateField_management(layer, field, calc)
-
-    except:
-        tb = sys.exc_info()[2]
-        tbinfo = traceback.format_tb(tb)[0]
-        pymsg = tbinfo + '\n' + str(sys.exc_type)+ ': ' + str(sys.exc_value)
-        arcpy.AddError(pymsg)
-        raise SystemError
-    finally:
-        arcpy.RefreshCatalog
-    
 def addZ(ZptLayer):
     #adds the z value to the table so that it is in the event table when we locate
     #points along the line route
@@ -92,11 +73,26 @@ def addZ(ZptLayer):
 		arcpy.AddError(pymsg)
 		raise SystemError
   
+def collarStatus(tRow):
+    #why a borehole has no collar elevation: OFF_DEM or NODATA if it was to
+    #come from the DEM, or NO_Z if the collar Z field is empty
+    try:
+        status = tRow.getValue(xsec_dem.STATUS_FIELD)
+    except:
+        status = None
+    return status or xsec_dem.NO_Z
+
 def boreholeLines():
     #creates 2d cross section view sticklogs that show the depth of each borehole
     try:
         # create an empty output featureclass with the fields of the event table
     	arcpy.CreateFeatureclass_management(scratchDir, bhLines, 'POLYLINE', zBoreholes, 'ENABLED', 'ENABLED')
+        if len(arcpy.ListFields(bhLines, xsec_dem.STATUS_FIELD)) == 0:
+            arcpy.AddField_management(bhLines, xsec_dem.STATUS_FIELD, 'TEXT', '#', '#', 10)
+        #the key of the section the sticklog is on
+        arcpy.AddField_management(bhLines, 'rkey', 'LONG')
+        #the exaggeration the sticklog is drawn at; its elevations are kept in Z
+        xsec_transform.addSectionFields(bhLines)
     
         # open search cursor on the event table
     	tRows = arcpy.SearchCursor(eventTable)
@@ -120,6 +116,7 @@ def boreholeLines():
                 #we also want the 'DISTANCE' value, calculated when the event table is built
                 #to be saved to this fc so it's needs to be in this list
                 names.append('distance')
+        names.append('rkey')
     			
         # enter while loop for each row in events table
         for tRow in tRows:
@@ -128,10 +125,13 @@ def boreholeLines():
             # borehole from the DEM or from a value in the collar z field
             try:
             	pnt1.Y = float(tRow.getValue(zField)) * float(ve)
+            	status = None
             except:
-            	arcpy.AddMessage('No collar elevation available for borehole ' + str(tRow.getValue(bhIdField)))
-            	arcpy.AddMessage('Using a value of 10000 for collar elevation')
-            	pnt1.Y = 10000
+                #no sticklog is drawn for a borehole without a collar elevation;
+                #the record is kept, without a shape, and the reason is
+                #written to ZStatus
+                status = collarStatus(tRow)
+                arcpy.AddMessage('No collar elevation available for borehole ' + str(tRow.getValue(bhIdField)) + ': ' + status)
                 
             pnt1.X = tRow.RouteM
             pnt2.X = pnt1.X
@@ -144,6 +144,8 @@ def boreholeLines():
             	arcpy.AddMessage('    No borehole depth available for borehole ' + str(tRow.getValue(bhIdField)))
             	arcpy.AddMessage('      Using a value of 5000 for borehole depth.')
             	pnt2.Y = pnt1.Y - 5000
+            pnt1.Z = pnt1.Y / float(ve)
+            pnt2.Z = pnt2.Y / float(ve)
             
             # add points to array
             array.add(pnt1)
@@ -151,7 +153,8 @@ def boreholeLines():
             
             # set array to the new feature's shape
             row = cur.newRow()
-            row.shape = array
+            if status is None:
+                row.shape = array
             
             # copy over the other attributes
             for name in names:
@@ -162,6 +165,8 @@ def boreholeLines():
                 except:
                     #if it can't be written, forget about it
                     pass
+            row.setValue(xsec_dem.STATUS_FIELD, status)
+            row.setValue(xsec_transform.VE_FIELD, float(ve))
                     
             # insert the feature
             cur.insertRow(row)
@@ -186,12 +191,6 @@ lineLayer = arcpy.GetParameterAsText(0)
 #if os.path.isabs(lineLayer):
 #    lineLayer = str(os.path.splitext(os.path.basename(lineLayer))[0])
 
-#can't figure out how to put this in the validator class ??
-result = arcpy.GetCount_management(lineLayer)
-if int(result.getOutput(0)) > 1:
-    arcpy.AddError(lineLayer + ' has more than one line in it.')
-    raise SystemError
-
 # elevation raster layer
 dem = arcpy.GetParameterAsText(1)
 
@@ -245,10 +244,18 @@ if append == 'true':
 #data frame name
 dfName = arcpy.GetParameterAsText(16)
 
+#parameter 17 is the derived output layer
+
+#measure mode and plane azimuth - how distance along the section, X in
+#cross-section view, is measured; see xsec_defs.measureParameters
+measureMode, azimuth = xsec_defs.measureParameters(18, 19)
+
 
 # BEGIN
 # ***************************************************************
 try:
+    xsec_defs.checkMeasureMode(measureMode)
+
     #check for 3DAnalyst extension
     checkExtensions()
     
@@ -257,22 +264,12 @@ try:
     scratchDir = arcpy.env.scratchWorkspace
     arcpy.env.workspace = scratchDir
     
-    #add an ORIG_FID field to the table that consists of values from the OID
-    desc = arcpy.Describe(lineLayer)
-    idField = desc.OIDFieldName
-    addAndCalc(lineLayer, 'ORIG_FID', '[' + idField + ']')
-    
-    #interpolate the line to add z values
-    zLine = lineLayer + '_z'
+    #interpolate z values for the line and measure it into a route, keyed by
+    #object id so that nothing is added to the table of the lines
     arcpy.AddMessage('Getting elevation values for the cross-section in  ' + lineLayer)
-    arcpy.InterpolateShape_3d(dem, lineLayer, zLine)
-    arcpy.AddMessage('   ' + zLine + ' written to ' + arcpy.env.scratchWorkspace)
-    
-    #measure it and turn it into a route
-    zmLine = lineLayer + '_zm'
-    arcpy.AddMessage('Measuring the length of ' + zLine)
-    arcpy.CreateRoutes_lr(zLine, 'ORIG_FID', zmLine, 'LENGTH', '#', '#', cp)
-    arcpy.AddMessage('   ' + zmLine + ' written to ' + arcpy.env.scratchWorkspace)
+    routes = xsec_dem.profileRoutes(dem, lineLayer, 'OID@', cp, mode=measureMode, azimuth=azimuth)
+    zmLine = routes.write(os.path.join('in_memory', os.path.basename(lineLayer) + '_zm'), 'ORIG_FID')
+    arcpy.AddMessage('   ' + zmLine + ' written to memory')
     
     #figure out where the collar elevation is coming from, a user specified field or to be
     #calculated by interpolation from the DEM and stored in 'zDEM'
@@ -285,20 +282,11 @@ try:
         #to minimize the processing time
     	arcpy.SelectLayerByLocation_management(bhLayer, 'WITHIN_A_DISTANCE', zmLine, buff)
     	zBoreholes = outName + '_zBoreholes'
-    	arcpy.InterpolateShape_3d(dem, bhLayer, zBoreholes)
+        arcpy.CopyFeatures_management(bhLayer, zBoreholes)
     
-    	#add DEM Z values to zBoreholes attribute table
-        #might already be there so we'll try to add it
-    	try:
-    		arcpy.AddField_management(zBoreholes, 'zDEM', 'FLOAT')
-    	except:
-    		pass
-        #and calc in the geometry x
-        try:
-            arcpy.CalculateField_management(zBoreholes, 'zDEM', '!SHAPE.FIRSTPOINT.Z!', 'PYTHON_9.3')
-        except:
-            #if the elevation cannot be determined for some reason, calc 0
-            arcpy.CalculateField_management(zBoreholes, 'zDEM', 0, 'PYTHON_9.3')
+        #add DEM Z values to zBoreholes attribute table, sampled in-process
+        #from the DEM. Boreholes that are off the DEM get a null.
+        xsec_dem.addSurfaceZ(zBoreholes, dem, 'zDEM')
         
     	#'DEM_Z' becomes the collar elevation field
     	zField = 'zDEM'
@@ -308,17 +296,14 @@ try:
     
     # locate boreholes points along the cross-section
     eventTable = outName + '_bhEvents'
-    rProps = 'rkey POINT RouteM'
     arcpy.AddMessage('Locating ' + zBoreholes + ' on ' + zmLine)
-    arcpy.LocateFeaturesAlongRoutes_lr(zBoreholes, zmLine, 'ORIG_FID', buff, eventTable, rProps, '#', 'DISTANCE')
-    arcpy.AddMessage('    ' + eventTable + ' written to ' + arcpy.env.scratchWorkspace)
-
-    #remove duplicate records that result from what appears to be
-    #an unresolved bug in the Locate Features Along Routes tool
-    #some points will get more than one record in the event table
-    #and slightly different, sub-mapunit, mValues
-    arcpy.DeleteIdentical_management(eventTable, bhIdField)
-    
+    radius = xsec_routes.searchRadius(buff, routes.sr)
+    #a borehole near more than one section is placed on each of them, keyed
+    #by section in rkey
+    n = xsec_routes.locateFeatures(zBoreholes, routes, radius, eventTable,
+        distanceField='Distance', allRoutes=True)
+    arcpy.AddMessage('    {} events on {} sections written to {}'.format(n, len(routes.ids), eventTable))
+
     # make the borehole lines to be used as routes
     bhLines = outName + '_bhLines'
     arcpy.AddMessage('Building lines in cross-section view from ' + eventTable)
@@ -332,6 +317,7 @@ try:
     		arcpy.AddMessage('Appending features to ' + appendFC)
     		#schemas do not have to match but no attributes will be copied over
     		#unless the fields are in both layers.
+    		xsec_transform.addSectionFields(appendFC)
     		arcpy.Append_management(bhLines, appendFC, 'NO_TEST')
     		outLayer = appendFC
     	else:
@@ -342,56 +328,84 @@ try:
         arcpy.AddMessage('No intervals table specified')
         arcpy.AddMessage('    ' + outFC + ' saved')     
     else:
-    	#or continue and place the intervals as events along the borehole routes
-    	#convert to routes
-    	bhRoutes = outName + '_bhRoutes'
-        arcpy.AddMessage("Measuring the length of borehole lines in " + bhLines)
-    	arcpy.CreateRoutes_lr(bhLines, bhIdField, bhRoutes, 'ONE_FIELD', bhDepthField, '#', 'UPPER_LEFT')
-        arcpy.AddMessage('    ' + bhRoutes + ' written to ' + arcpy.env.scratchWorkspace)
-       
-    	#place borehole intervals (line events) on borehole routes
+    	#or continue and place the intervals as events along the borehole routes,
+        #one section at a time because a borehole near two sections has a
+        #sticklog on each and the sticklogs are measured into routes by borehole id
         props = intBhIdFld + ' LINE ' + intTopDepthFld + ' ' + intBotDepthFld
-        arcpy.AddMessage("Placing borehole intervals on routes in " + bhRoutes)
-        arcpy.MakeRouteEventLayer_lr(bhRoutes, bhIdField, intervalsTable, props, 'lyr', '#', 'ERROR_FIELD')
-        
-        #extract only valid route events from this in-memory layer
-        arcpy.AddMessage('Filtering interval records with location errors.')
         bhIntervals = outName + '_intervals'
-        arcpy.Select_analysis('lyr', bhIntervals, "\"LOC_ERROR\" <> 'ROUTE NOT FOUND'")
-        arcpy.AddMessage('    ' + bhIntervals + ' written to ' + arcpy.env.scratchWorkspace)
-    
-        #now, join to eventTable in order to pass over the 'DISTANCE' which is the distance
-        #the sticklog is away from the cross-section line
-        arcpy.AddField_management(bhIntervals, 'Dis2XSec', 'DOUBLE')
-        layer2 = arcpy.MakeFeatureLayer_management(bhIntervals, 'lyr2')
-        arcpy.env.qualifiedFieldNames = False
-        arcpy.AddJoin_management('lyr2', bhIdField, eventTable, bhIdField)
-        arcpy.CalculateField_management('lyr2', "Dis2XSec", "!Distance!", "PYTHON_9.3", "")
-
-        #output options
-        if append == 'true':
-            arcpy.AddMessage('Appending intervals to ' + appendFC)
-            arcpy.Append_management(bhIntervals, appendFC, 'NO_TEST')
-            outLayer = appendFC
-        else: 
-            #copy the final fc from the scratch gdb to the output directory/gdb
-            srcIntervals = os.path.join(scratchDir, bhIntervals)
-            arcpy.CopyFeatures_management(srcIntervals, outFC)
-            arcpy.AddMessage('    ' + bhIntervals + ' copied to ' + outFC)
-            outLayer = outFC
+        sectionIntervals = []
+        for key in sorted(set(routes.ids)):
+            where = '{} = {}'.format(arcpy.AddFieldDelimiters(bhLines, 'rkey'), key)
+            arcpy.MakeFeatureLayer_management(bhLines, 'bhLyr', where)
+            if int(arcpy.GetCount_management('bhLyr').getOutput(0)) == 0:
+                continue
+
+            #convert to routes
+            bhRoutes = '{}_bhRoutes{}'.format(outName, key)
+            arcpy.AddMessage('Measuring the length of borehole lines on section ' + str(key))
+            arcpy.CreateRoutes_lr('bhLyr', bhIdField, bhRoutes, 'ONE_FIELD', bhDepthField, '#', 'UPPER_LEFT')
+            arcpy.AddMessage('    ' + bhRoutes + ' written to ' + arcpy.env.scratchWorkspace)
+
+            #place borehole intervals (line events) on borehole routes
+            arcpy.AddMessage('Placing borehole intervals on routes in ' + bhRoutes)
+            arcpy.MakeRouteEventLayer_lr(bhRoutes, bhIdField, intervalsTable, props, 'lyr', '#', 'ERROR_FIELD')
+
+            #extract only valid route events from this in-memory layer
+            arcpy.AddMessage('Filtering interval records with location errors.')
+            keyIntervals = '{}{}'.format(bhIntervals, key)
+            arcpy.Select_analysis('lyr', keyIntervals, "\"LOC_ERROR\" <> 'ROUTE NOT FOUND'")
+            arcpy.AddField_management(keyIntervals, 'rkey', 'LONG')
+            arcpy.CalculateField_management(keyIntervals, 'rkey', key)
+            sectionIntervals.append(keyIntervals)
+
+        if not sectionIntervals:
+            #none of the boreholes near the sections are in the intervals table
+            arcpy.AddWarning('No borehole intervals were placed on any section, no output was written')
+            outLayer = None
+        else:
+            arcpy.AddMessage('Merging the intervals of every section')
+            arcpy.Merge_management(sectionIntervals, bhIntervals)
+            arcpy.AddMessage('    ' + bhIntervals + ' written to ' + arcpy.env.scratchWorkspace)
+
+            #pass over the 'DISTANCE' from the event of the same borehole and section,
+            #which is the distance the sticklog is away from the cross-section line
+            arcpy.AddField_management(bhIntervals, 'Dis2XSec', 'DOUBLE')
+            distances = {}
+            for row in arcpy.da.SearchCursor(eventTable, [bhIdField, 'rkey', 'Distance']):
+                distances[(row[0], row[1])] = row[2]
+            rows = arcpy.da.UpdateCursor(bhIntervals, [intBhIdFld, 'rkey', 'Dis2XSec'])
+            for row in rows:
+                row[2] = distances.get((row[0], row[1]))
+                rows.updateRow(row)
+            del rows
+
+            #the intervals are measured along the sticklogs, so their vertices
+            #have the elevations of the sticklogs in Z
+            xsec_transform.recordVE(bhIntervals, ve)
+
+            #output options
+            if append == 'true':
+                arcpy.AddMessage('Appending intervals to ' + appendFC)
+                xsec_transform.addSectionFields(appendFC)
+                arcpy.Append_management(bhIntervals, appendFC, 'NO_TEST')
+                outLayer = appendFC
+            else: 
+                #copy the final fc from the scratch gdb to the output directory/gdb
+                srcIntervals = os.path.join(scratchDir, bhIntervals)
+                arcpy.CopyFeatures_management(srcIntervals, outFC)
+                arcpy.AddMessage('    ' + bhIntervals + ' copied to ' + outFC)
+                outLayer = outFC
     
     #now, check for whether the user wants the output in a particular data frame
     #seems to inconsistently activate the data frame
     #layer will not be added unless Geoprocessing > Geoprocessing Options >
     #   'Add results of geoprocessing operations to the display' is checked
-    if not dfName == '' and not dfName == 'ArcMap only':
+    if outLayer and not dfName == '' and not dfName == 'ArcMap only':
     	mxd = arcpy.mapping.MapDocument('Current')
     	df = arcpy.mapping.ListDataFrames(mxd, dfName)[0]
     	mxd.activeView = df
     	arcpy.SetParameterAsText(17, outLayer)
-        
-    #some cleanup
-    arcpy.DeleteField_management(arcpy.GetParameterAsText(0), 'ORIG_FID')
+
     
 except:
     tb = sys.exc_info()[2]
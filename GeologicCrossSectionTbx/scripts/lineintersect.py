@@ -19,6 +19,9 @@ import os
 import sys
 import traceback
 import arcpy
+import xsec_defs
+import xsec_dem
+import xsec_routes
 
 # FUNCTIONS
 # *******************************************************
@@ -41,26 +44,6 @@ def getCPValue(quadrant):
 
     return cpDict[quadrant]
 
-def addAndCalc(layer, field, calc):
-    '''adds a field to a table (layer) of name (field), and calcs a value
-    created as means to add an rkey value to line layers that consist
-    of OID values'''
-    try:
-        #add a key field if it doesn't already exist
-        if len(arcpy.ListFields(layer, field)) ==0:
-            arcpy.AddField_management(layer, field, 'LONG')
-
-		#calculate the id value over to the new value so we always have it in the table
-		#as it goes through it's various transformations, some of which will re-write
-		#the id field.
-        arcpy.CalculateField_management(layer, field, calc)
-
-    except:
-        arcpy.AddError(traceback.format_exc())
-        raise SystemError
-    finally:
-        arcpy.RefreshCatalog
-
 def xsecLines(outFC, ZinterPts, eventTable, ZField):
     '''shows the intersections between the cross-section line and other lines
     in map view as lines in cross-section view'''
@@ -96,10 +79,12 @@ def xsecLines(outFC, ZinterPts, eventTable, ZField):
             #set Y1 equal = DEM_Z value * the ve
             try:
                 pnt1.Y = float(tRow.getValue(ZField)) * float(ve)
+                hasZ = True
             except:
-                arcpy.AddMessage('No elevation for feature ' + str(tRow.getValue('OBJECTID')))
-                arcpy.AddMessage('Using a value of ' + str(100 * float(ve)) + ' for elevation')
-                pnt1.Y = 100 * float(ve)
+                #the feature is written without a shape; the reason, e.g.
+                #OFF_DEM, is in ZStatus
+                arcpy.AddMessage('No elevation for feature ' + str(tRow.getValue('OBJECTID')) + ': ' + str(tRow.getValue(xsec_dem.STATUS_FIELD)))
+                hasZ = False
 
             pnt1.X = tRow.RouteM
             pnt2.X = pnt1.X
@@ -113,7 +98,8 @@ def xsecLines(outFC, ZinterPts, eventTable, ZField):
 
             #set array to the new feature's shape
             row = cur.newRow()
-            row.shape = array
+            if hasZ:
+                row.shape = array
 
             #copy over the other attributes
             for name in names:
@@ -158,17 +144,18 @@ def xsecPoints(outFC, Zpts, eventTable, ZField):
     	    pnt = arcpy.CreateObject('Point')
             try:
                 pnt.Y = float(tRow.getValue(ZField)) * float(ve)
+                hasZ = True
             except:
-                arcpy.AddMessage('    No elevation for feature ' + str(tRow.getValue('OBJECTID')))
-                arcpy.AddMessage('      Using a value of 0 for elevation')
-                pnt.Y = 0
+                arcpy.AddMessage('    No elevation for feature ' + str(tRow.getValue('OBJECTID')) + ': ' + str(tRow.getValue(xsec_dem.STATUS_FIELD)))
+                hasZ = False
 
     		#set the point's X and Y coordinates
             pnt.X = float(tRow.getValue('RouteM'))
 
     		#set the point to the new feature's shape
             row = cur.newRow()
-            row.shape = pnt
+            if hasZ:
+                row.shape = pnt
 
     		#copy over the other attributes
             for name in names:
@@ -272,9 +259,17 @@ if append == 'true':
 #data frame name
 dfName = arcpy.GetParameterAsText(9)
 
+#parameter 10 is the derived output layer
+
+#measure mode and plane azimuth - how distance along the section, X in
+#cross-section view, is measured; see xsec_defs.measureParameters
+measureMode, azimuth = xsec_defs.measureParameters(11, 12)
+
 #BEGIN
 #*******************************************************
 try:
+    xsec_defs.checkMeasureMode(measureMode)
+
     #is there a better place to put this?
     if outFC == "" and appendFC == "":
         arcpy.AddError("Provide the name of a new feature class or one to which the features will be appended.")
@@ -296,16 +291,14 @@ try:
     scratchDir = arcpy.env.scratchWorkspace
     arcpy.env.workspace = scratchDir
 
-    #add an rkey field to the table that consists of values from the OID
-    desc = arcpy.Describe(xsecLayer)
-    idField = desc.OIDFieldName
-    addAndCalc(xsecLayer, 'ORIG_FID', '[' + idField + ']')
-
-    #measure the cross section line
-    mLine = xsecName + '_m'
+    #measure the cross section line into a route keyed by object id, so
+    #nothing is added to the table of the line
     arcpy.AddMessage('Measuring the length of the cross section')
-    arcpy.CreateRoutes_lr(xsecLayer, 'ORIG_FID', mLine, 'LENGTH', '#', '#', cp)
-    arcpy.AddMessage('    ' + mLine + ' written to ' + scratchDir)
+    if measureMode == '3D':
+        #slope distances need the elevations of the line
+        routes = xsec_dem.profileRoutes(dem, xsecLayer, 'OID@', cp, mode=measureMode, azimuth=azimuth)
+    else:
+        routes = xsec_routes.sectionRoutes(xsecLayer, cp, measureMode, azimuth)
 
     #intersect the cross section with the lines layer
     #creates a table with only the original FIDs of the input features.
@@ -334,14 +327,12 @@ try:
 
     #get elevations for the intersection locations
     arcpy.AddMessage('Adding elevations from {}'.format(dem))
-    arcpy.AddSurfaceInformation_3d(explode_pts, dem, 'Z')
+    xsec_dem.addSurfaceZ(explode_pts, dem, 'Z')
   
     #locate intersection points on measured cross-section
     eventTable = outName + '_interEvents'
-    rProps = 'rkey POINT RouteM'
-    arcpy.AddMessage('Locating lines in {} on {}'.format(linesLayer, mLine))
-    arcpy.LocateFeaturesAlongRoutes_lr(explode_pts, mLine, 'ORIG_FID', '10', 
-        eventTable, rProps, 'FIRST', 'NO_DISTANCE', 'NO_ZERO')
+    arcpy.AddMessage('Locating lines in {} on {}'.format(linesLayer, xsecLayer))
+    xsec_routes.locateFeatures(explode_pts, routes, 10, eventTable)
     arcpy.AddMessage('    {} written to {}'.format(eventTable, scratchDir))
     
     if outShape == 'lines':
@@ -351,9 +342,6 @@ try:
     	xInterFeats = outName + '_xsecPts'
     	xsecPoints(xInterFeats, explode_pts, eventTable, 'Z')
     
-    #I think we're done with 'ORIG_FID' here, nuke it
-    arcpy.DeleteField_management(xsecLayer, 'ORIG_FID')
-    
     #transfer attributes from linesLayer to xInterFeats
     #first, what is the ID field of linesLayer (could be 'OBJECTID' or 'FID')
     descLines = arcpy.Describe(linesLayer)
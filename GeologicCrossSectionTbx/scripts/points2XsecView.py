@@ -20,6 +20,10 @@ import sys
 import math
 import traceback
 import arcpy
+import xsec_defs
+import xsec_dem
+import xsec_routes
+import xsec_transform
 
 # FUNCTIONS
 # ***************************************************************
@@ -129,12 +133,6 @@ lineLayer = arcpy.GetParameterAsText(0)
 #have slashes in the name/path)
 lineLyrName = arcpy.Describe(lineLayer).name 
 
-#can't figure out how to put this in the validator class ??
-result = arcpy.GetCount_management(lineLayer)
-if int(result.getOutput(0)) > 1:
-    arcpy.AddError(lineLayer + ' has more than one line in it.')
-    raise SystemError
-
 # elevation raster layer
 dem = arcpy.GetParameterAsText(1)
 
@@ -178,9 +176,20 @@ if append == 'true':
 #data frame name
 dfName = arcpy.GetParameterAsText(12)
 
+#parameter 13 is the derived output layer
+
+#measure mode and plane azimuth - how distance along the section, X in
+#cross-section view, is measured; see xsec_defs.measureParameters
+measureMode, azimuth = xsec_defs.measureParameters(14, 15)
+
 # BEGIN
 # ***************************************************************
 try:
+    xsec_defs.checkMeasureMode(measureMode)
+    if measureMode == '3D' and dem == '':
+        arcpy.AddError("Measuring slope distances (3D) requires a DEM.")
+        raise SystemError
+
     #check for 3DAnalyst extension
     checkExtensions()
     
@@ -196,17 +205,18 @@ try:
     
     if arcpy.Exists(outFC): arcpy.Delete_management(outFC)
     
-    #add an ORIG_FID field to the table that consists of values from the OID
-    desc = arcpy.Describe(lineLayer)
-    idField = desc.OIDFieldName
-    addAndCalc(lineLayer, 'ORIG_FID', '[' + idField + ']')
-    
-    #measure it and turn it into a route
-    mLine = lineLyrName + '_m'
-    if arcpy.Exists(mLine): arcpy.Delete_management(mLine)
-    arcpy.AddMessage('Measuring the length of cross-section line')
-    arcpy.CreateRoutes_lr(lineLayer, 'ORIG_FID', mLine, 'LENGTH', '#', '#', cp)
-    arcpy.AddMessage('{} written to {}'.format(mLine, scratchDir))
+    #measure the lines and turn them into routes. There may be any number of
+    #sections; every point is placed on each of them it is near, and the
+    #events and the output are keyed by section in rkey, the object id of
+    #the line. Nothing is added to the table of the lines
+    arcpy.AddMessage('Measuring the length of the cross-section lines')
+    if measureMode == '3D':
+        #slope distances need the elevations of the lines
+        routes = xsec_dem.profileRoutes(dem, lineLayer, 'OID@', cp, mode=measureMode, azimuth=azimuth)
+    else:
+        routes = xsec_routes.sectionRoutes(lineLayer, cp, measureMode, azimuth)
+    mLine = routes.write(os.path.join('in_memory', lineLyrName + '_m'), 'ORIG_FID')
+    arcpy.AddMessage('{} written to memory'.format(mLine))
     
     #select points according to the section distance
     arcpy.SelectLayerByLocation_management(ptLayer, 'WITHIN_A_DISTANCE', mLine, buff)
@@ -223,36 +233,30 @@ try:
         z_field = ptz_field
     else:
         arcpy.AddMessage('Adding elevations from {}'.format(dem))
-        arcpy.AddSurfaceInformation_3d(points_near_line, dem, 'Z')
+        xsec_dem.addSurfaceZ(points_near_line, dem, 'Z')
         z_field = 'Z'
  
-    #add ORIG_ID for deleting identical events and for joining attributes later
+    #add ORIG_PTID for joining attributes later
     addAndCalc(points_near_line, 'ORIG_PTID', '[OBJECTID]')
     
     # locate points along the cross-section
     eventTable = outName + '_ptEvents'
-    rProps = 'rkey POINT RouteM'
     arcpy.AddMessage('Locating {} on {}'.format(points_near_line, mLine))
-    arcpy.LocateFeaturesAlongRoutes_lr(points_near_line, mLine, 'ORIG_FID', buff, 
-        eventTable, rProps, '#', 'DISTANCE')
-    arcpy.AddMessage('   {} written to {}'.format(eventTable, scratchDir))
-
-    #remove duplicate records that result from what appears to be
-    #an unresolved bug in the Locate Features Along Routes tool
-    #some points will get more than one record in the event table
-    #and slightly different, sub-mapunit, mValues
-    try:
-        arcpy.DeleteIdentical_management(eventTable, 'ORIG_PTID')
-    except:
-        pass
-
-    #place points as events on the measured cross section line
-    #TANGENT location angle is in cartesian coordinate system,
+    radius = xsec_routes.searchRadius(buff, routes.sr)
+    #the direction of the route at each event, or of the plane in PLANE mode,
+    #is written to LOC_ANGLE. It is in the cartesian coordinate system,
     #0 is to the right, not north.
+    n = xsec_routes.locateFeatures(points_near_line, routes, radius, eventTable,
+        distanceField='Distance', angleField='LOC_ANGLE', allRoutes=True)
+    arcpy.AddMessage('   {} events on {} sections written to {}'.format(n, len(routes.ids), eventTable))
+
+    #place points as events on the measured cross section line. Only the
+    #features are needed; the shapes are rebuilt from RouteM below, so events
+    #projected past the ends of a line in PLANE mode are kept
     eventLyr = '_lyr'
     rProps = 'rkey POINT RouteM'
     arcpy.MakeRouteEventLayer_lr(mLine, 'ORIG_FID', eventTable, rProps, eventLyr, 
-        '#', 'ERROR_FIELD', 'ANGLE_FIELD', 'TANGENT')
+        '#', 'ERROR_FIELD')
     eventPts = outName + '_events'
     arcpy.CopyFeatures_management(eventLyr, eventPts)
     arcpy.AddMessage('   {} feature layer written to {}'.format(eventPts, scratchDir))
@@ -260,9 +264,14 @@ try:
     # add DistanceFromSection
     arcpy.AddField_management(eventPts,'DistanceFromSection','FLOAT')
     
+    #points without elevations are flagged in ZStatus. It is already there if
+    #the elevations came from the DEM
+    if len(arcpy.ListFields(eventPts, xsec_dem.STATUS_FIELD)) == 0:
+        arcpy.AddField_management(eventPts, xsec_dem.STATUS_FIELD, 'TEXT', '#', '#', 10)
+    
     #in the case where isOrientationData is false, we can't call orientation related
     #fields or the cursor blows up
-    fldList = ['OBJECTID', 'SHAPE@M', z_field, 'SHAPE@XY', 'LOC_ANGLE', 
+    fldList = ['OBJECTID', 'RouteM', z_field, 'SHAPE@XY', 'LOC_ANGLE', 
          'DISTANCE', 'DistanceFromSection' ]
 
     #check for whether these are structural data
@@ -276,6 +285,16 @@ try:
                       'ApparentInclination', 'ApparentIncVE', 'SymbolRotation'))
     else:
         isOrientationData = False       
+
+    #the exaggeration each point is drawn at and its elevation are recorded
+    #so the points can be redrawn at another exaggeration
+    xsec_transform.addSectionFields(eventPts, True)
+    fldList.extend((xsec_transform.VE_FIELD, xsec_transform.Z_FIELD))
+    iVE = len(fldList) - 2
+
+    #the status field goes last so it doesn't move the others
+    fldList.append(xsec_dem.STATUS_FIELD)
+    iStatus = len(fldList) - 1
     
     #open a data access update-cursor, edit geometries, and calculate attributes
     #discovered during development: for some reason, when a few structural points are
@@ -295,15 +314,19 @@ try:
             x = row[1]
             #Z for Y
             if row[2] == None:
-                y = -999
+                #no shape for a point without an elevation; the reason is
+                #left in ZStatus
                 arcpy.AddMessage('    OBJECTID {} has no elevation value'
                     .format(str(row[0])))
-                arcpy.AddMessage('        Maybe it does not lie over the DEM?')
-                arcpy.AddMessage('        calculating a value of -999')
+                row[3] = None
+                if row[iStatus] == None:
+                    row[iStatus] = xsec_dem.NO_Z
+                arcpy.AddMessage('        {}'.format(row[iStatus]))
             else:
-                y = row[2] * ve
-            #write geometry through SHAPE@XY
-            row[3] = [x, y]
+                #write geometry through SHAPE@XY
+                row[3] = [x, row[2] * ve]
+                row[iVE] = ve
+                row[iVE + 1] = row[2]
 
         except:
             arcpy.AddMessage('    Failed to make shape: OBJECTID {}, M = {}, Z = {}'
@@ -344,11 +367,11 @@ try:
     for fld in 'DISTANCE', 'LOC_ANGLE', 'ORIG_FID':
         arcpy.DeleteField_management(eventPts, fld)
     del row, rows
-    arcpy.DeleteField_management(lineLayer, 'ORIG_FID')
         
     #output options
     if append == 'true':
         arcpy.AddMessage('Appending intervals to ' + appendFC)
+        xsec_transform.addSectionFields(appendFC, True)
         arcpy.Append_management(eventPts, appendFC, 'NO_TEST')
         outLayer = appendFC
     else: 
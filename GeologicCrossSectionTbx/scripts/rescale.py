@@ -14,7 +14,10 @@
 import arcpy
 import string
 import sys
+import time
 import traceback 
+import xsec_defs
+import xsec_transform
 
 #errors during testing were not getting reported with this function
 #works in other scripts ??!!
@@ -38,62 +41,28 @@ ve = arcpy.GetParameterAsText(1)
 # factor by which to rescale in the X direction
 he = arcpy.GetParameterAsText(2)
 
+# redraw from recorded values - if true, ve is the new vertical exaggeration
+# and every feature that recorded the exaggeration it was drawn at is
+# redrawn from its recorded elevations; he is not used
+reexaggerate = xsec_defs.optionalParameter(3, 'false') == 'true'
 
 # BEGIN
 # *******************************************************
 try:
-    for layer in xslayers:
+    # every vertex of a feature is scaled in one operation
+    start = time.time()
+    if reexaggerate:
+        arcpy.AddMessage('Redrawing {} layers at a vertical exaggeration of {}'.format(len(xslayers), ve))
+        stats = xsec_transform.reexaggerateLayers(xslayers, ve)
+    else:
+        arcpy.AddMessage('Rescaling {} layers'.format(len(xslayers)))
+        stats = xsec_transform.rescaleLayers(xslayers, he, ve)
+    for layer, nFeatures, nVertices, seconds in stats:
         arcpy.AddMessage(layer)
-                
-        # open an update cursor
-        upcur = arcpy.UpdateCursor(layer)
-        shptype = arcpy.Describe(layer).ShapeType
-                    
-        # enter while loop for each feature/row
-        for row in upcur:
-            # Create the geometry object
-            feat = row.shape
-        
-            #special (simple) case for points
-            if shptype == 'Point':
-                oldPnt = feat.GetPart(0)
-                newPnt = arcpy.Point()
-                newPnt.Y = float(oldPnt.Y) * float(ve)
-                newPnt.X = float(oldPnt.X) * float(he)
-                row.shape = newPnt
-                upcur.updateRow(row)
-        
-                        
-            #lines and polygons
-            else:
-                new_Feat_Shape = arcpy.Array()
-                a = 0
-                while a < feat.partCount:
-                    # Get each part of the geometry)
-                    array = feat.getPart(a)
-                    newarray = arcpy.Array()
-                                                    
-                    # otherwise get the first point in the array of points
-                    pnt = array.next()
-                                    
-                    while pnt:
-                        pnt.Y = float(pnt.Y) * float(ve)
-                        pnt.X = float(pnt.X) * float(he)
-                                    
-                        #Add the modified point into the new array
-                        newarray.add(pnt)
-                        pnt = array.next()
-            
-                    #Put the new array into the new feature  shape
-                    new_Feat_Shape.add(newarray)
-                    a = a + 1
-                                
-                #Update the row object's shape  
-                row.shape = new_Feat_Shape
-                
-                #Update the feature's information in the workspace using the cursor
-                upcur.updateRow(row)
+        arcpy.AddMessage('    {} features, {} vertices in {:.2f} seconds'.format(nFeatures, nVertices, seconds))
+        if reexaggerate and nFeatures == 0:
+            arcpy.AddMessage('    no features with a recorded vertical exaggeration ({})'.format(xsec_transform.VE_FIELD))
+    arcpy.AddMessage('{} vertices rescaled in {:.2f} seconds'.format(sum(s[2] for s in stats), time.time() - start))
 
 except:
-    #del upcur
-    tracebackReport
\ No newline at end of file
+    tracebackReport()
@@ -16,6 +16,10 @@ import sys
 import os
 import traceback
 import arcpy
+import xsec_defs
+import xsec_dem
+import xsec_routes
+import xsec_transform
 
 
 # FUNCTIONS
@@ -40,30 +44,6 @@ def getCPValue(quadrant):
     return cpDict[quadrant]
 
 
-def addAndCalc(layer, field, calc):
-    #adds a field to a table (layer) of name (field), and calcs a value
-    #created as means to add an rkey value to line layers that consist
-    #of OID values
-    try:
-        #add a key field if it doesn't already exist
-        if len(arcpy.ListFields(layer, field)) == 0:
-            arcpy.AddField_management(layer, field, 'LONG')
-
-		#calculate the id value over to the new value so we always have it in the table
-		#as it goes through it's various transformations, some of which will re-write
-		#the id field.
-        arcpy.CalculateField_management(layer, field, calc)
-
-    except:
-        tb = sys.exc_info()[2]
-        tbinfo = traceback.format_tb(tb)[0]
-        pymsg = tbinfo + '\n' + str(sys.exc_type)+ ': ' + str(sys.exc_value)
-        arcpy.AddError(pymsg)
-        raise SystemError
-    finally:
-        arcpy.RefreshCatalog
-
-
 def createEventTable(features, zmLine, rkey, buff, eventTable, rProps):
     #builds event table of points located along a line route
     try:
@@ -77,85 +57,6 @@ def createEventTable(features, zmLine, rkey, buff, eventTable, rProps):
         arcpy.AddError(pymsg)
         raise SystemError
 
-def placeEvents(inRoutes, idRteFld, eventTable, eventRteFld, fromVar, toVar, eventLay):
-    #place events along routes, creates a temporary layer
-    try:
-		arcpy.AddMessage('Placing line events on ' + inRoutes)
-		props = eventRteFld + ' LINE ' + fromVar + ' ' + toVar
-
-		#this makes an event layer where the table includes all records even if they were not located
-		#on any routes
-		arcpy.MakeRouteEventLayer_lr(inRoutes, idRteFld, eventTable, props, 'lyr')
-		arcpy.AddMessage(eventTable + ' written to temporary memory')
-
-		#one way to select only events that were located on a valid route is to
-		#save the layer to a feature class,
-		arcpy.CopyFeatures_management('lyr', 'lyr2')
-
-		#...create an in-memory layer based on that feature class and limited to where
-		#Shape_Length <> 0,
-		arcpy.MakeFeatureLayer_management('lyr2', 'lyr3', "Shape_Length <> 0")
-
-		#make a new selection
-		#arcpy.SelectLayerByAttribute_management('lyr2', "NEW_SELECTION", "Shape_Length <> 0")
-
-		arcpy.AddMessage('Saving temp layer to permanent memory')
-
-		#...and copy to the output feature class
-		arcpy.CopyFeatures_management('lyr3', eventLay)
-		arcpy.AddMessage(eventLay + ' written to ' + arcpy.env.scratchWorkspace)
-
-    except:
-        tb = sys.exc_info()[2]
-        tbinfo = traceback.format_tb(tb)[0]
-        pymsg = tbinfo + '\n' + str(sys.exc_type)+ ': ' + str(sys.exc_value)
-        arcpy.AddError(pymsg)
-        raise SystemError
-
-def plan2side(zmLines, ve):
-    #flip map view lines to cross section view without creating a copy
-    #this function updates the existing geometry
-    arcpy.AddMessage('Flipping ' + zmLines + ' from map view to cross-section view')
-    try:
-        rows = arcpy.UpdateCursor(zmLines)
-        n = 0
-        for row in rows:
-            # Create the geometry object
-            feat = row.shape
-            new_Feat_Shape = arcpy.Array()
-            a = 0
-            while a < feat.partCount:
-                # Get each part of the geometry)
-                array = feat.getPart(a)
-                newarray = arcpy.Array()
-
-                # otherwise get the first point in the array of points
-                pnt = array.next()
-
-                while pnt:
-                    pnt.X = float(pnt.M)
-                    pnt.Y = float(pnt.Z) * float(ve)
-
-                    #Add the modified point into the new array
-                    newarray.add(pnt)
-                    pnt = array.next()
-
-                #Put the new array into the new feature  shape
-                new_Feat_Shape.add(newarray)
-                a = a + 1
-
-            #Update the row object's shape
-            row.shape = new_Feat_Shape
-
-            #Update the feature's information in the workspace using the cursor
-            rows.updateRow(row)
-    except:
-        tb = sys.exc_info()[2]
-        tbinfo = traceback.format_tb(tb)[0]
-        pymsg = tbinfo + '\n' + str(sys.exc_type)+ ': ' + str(sys.exc_value)
-        arcpy.AddError(pymsg)
-        raise SystemError
-
 # PARAMETERS
 # *******************************************************
 # Cross section(s) layer
@@ -214,9 +115,17 @@ if append:
 #data frame name
 dfName = arcpy.GetParameterAsText(8)
 
+#parameter 9 is the derived output layer
+
+#measure mode and plane azimuth - how distance along the section, X in
+#cross-section view, is measured; see xsec_defs.measureParameters
+measureMode, azimuth = xsec_defs.measureParameters(10, 11)
+
 #BEGIN
 #*******************************************************
 try:
+    xsec_defs.checkMeasureMode(measureMode)
+
     #Check for the 3d Analyst extension
     checkExtensions()
     
@@ -234,32 +143,28 @@ try:
     arcpy.env.workspace = scratchDir
     arcpy.AddMessage(scratchDir)
 
-    #add an ORIG_FID field to the table that consists of values from the OID
-    desc = arcpy.Describe(lineLayer)
-    idField = desc.OIDFieldName
-    addAndCalc(lineLayer, 'ORIG_FID', '[' + idField + ']')
-
-    #it's necessary to interpolate the line so that a new feature is created in
-    #the scratch gdb which has a length in the units of the SR of the dem.
-    #interpolate the line to add z values
-    zLine = line_layer_name + '_z'
+    #interpolate z values for the line and measure it into a route, in the
+    #SR of the dem so that the measures are in the units of the dem. Routes
+    #are keyed by object id, so nothing is added to the table of the lines
     arcpy.AddMessage('Getting elevation values for the cross-section in ' + lineLayer)
-    arcpy.InterpolateShape_3d(dem, lineLayer, zLine)
+    routes = xsec_dem.profileRoutes(dem, lineLayer, 'OID@', cp, mode=measureMode, azimuth=azimuth)
 
-    #measure it and turn it into a route
-    zmLine = line_layer_name + '_zm'
-    arcpy.AddMessage('Measuring the length of the line in ' + zLine)
-    arcpy.CreateRoutes_lr(zLine, 'ORIG_FID', zmLine, 'LENGTH', '#', '#', cp)
+    #polygons are cut out of the routes between measures, which only works
+    #if the measures never go back; CHORD and PLANE measures of a line that
+    #doubles back do
+    routes.checkMonotonic(range(routes.lines.nFeatures))
 
     #intersect with geology layer
     eventTable = poly_layer_name + '_polyEvents'
-    rProps = 'rkey LINE FromM ToM'
-    arcpy.AddMessage('Locating ' + polyLayer + ' on ' + zmLine)
-    arcpy.LocateFeaturesAlongRoutes_lr(polyLayer, zmLine, 'ORIG_FID', '#', eventTable, rProps, 'FIRST', 'NO_DISTANCE', 'NO_ZERO')
+    arcpy.AddMessage('Locating ' + polyLayer + ' on ' + lineLayer)
+    n = xsec_routes.overlayPolygons(polyLayer, routes, eventTable)
+    arcpy.AddMessage('    {} intervals written to {}'.format(n, eventTable))
 
     #place line events on interpolated route
     locatedEvents = polyLayer + '_located'
-    placeEvents(zmLine, 'ORIG_FID', eventTable, 'rkey', 'FromM', 'ToM', locatedEvents)
+    arcpy.AddMessage('Placing line events on ' + lineLayer)
+    n = xsec_routes.placeEvents(routes, eventTable, 'rkey', 'FromM', 'ToM', locatedEvents)
+    arcpy.AddMessage('    {} events written to {}'.format(n, locatedEvents))
 
     #flip the surface profile events
     #create an empty container for the features that has no spatial reference
@@ -272,18 +177,24 @@ try:
     arcpy.Append_management(locatedEvents, zmProfiles)
 
     #flip the lines, swapping M for X and Z for Y
-    plan2side(zmProfiles, ve)
+    arcpy.AddMessage('Flipping ' + zmProfiles + ' from map view to cross-section view')
+    n = xsec_transform.plan2side(zmProfiles, ve)
+    arcpy.AddMessage('    {} vertices flipped'.format(n))
+
+    #record the exaggeration so the profiles can be redrawn at another one
+    #from the elevations kept in Z
+    xsec_transform.recordVE(zmProfiles, ve)
 
     #some cleanup
     #comment out the next two lines for troubleshooting
     for fld in ['rkey', 'FromM', 'ToM']:
         arcpy.DeleteField_management(zmProfiles, fld)
-    arcpy.DeleteField_management(lineLayer, 'ORIG_FID')
 
     #now, to worry about the output
     #check to see if we are to append the features to an existing fc
     if append == 'true':
         arcpy.AddMessage('Appending features to ' + appendFC)
+        xsec_transform.addSectionFields(appendFC)
         arcpy.Append_management(zmProfiles, appendFC)
         outLayer = appendFC
     else:
@@ -3,7 +3,7 @@ Name: surfaceprofile.py
 Description: ArcToolbox tool script to create one or more surface profiles from an ArcMap line layer
     in a  cross sectional view shapefile. Requires a line layer and a DEM in the same
     coordinate system.
-Requirements: 3D Analyst extension, CreateRoutes extension is available with all Arc modules
+Requirements: 3D Analyst extension
 Author: Evan Thoms, U.S. Geological Survey, ethoms@usgs.gov
 Date: 8/8/07
 mods beginning 5/21/10
@@ -19,6 +19,12 @@ import sys
 import os
 import traceback
 import arcpy
+import numpy as np
+import xsec_defs
+import xsec_dem
+import xsec_lines
+import xsec_routes
+import xsec_transform
 
 
 # FUNCTIONS
@@ -42,96 +48,6 @@ def getCPValue(quadrant):
 
     return cpDict[quadrant]
 
-def addAndCalc(layer, field, calc):
-    #adds a field to a table (layer) of name (field), and calcs a value
-    #created as means to add an rkey value to line layers that consist
-    #of OID values
-    try:
-        #add a key field if it doesn't already exist
-        if len(arcpy.ListFields(layer, field)) == 0:
-            arcpy.AddField_management(layer, field, 'LONG')
-
-		#calculate the id value over to the new value so we always have it in the table
-		#as it goes through it's various transformations, some of which will re-write
-		#the id field.
-        arcpy.CalculateField_management(layer, field, calc)
-
-    except:
-        tb = sys.exc_info()[2]
-        tbinfo = traceback.format_tb(tb)[0]
-        pymsg = tbinfo + '\n' + str(sys.exc_type)+ ': ' + str(sys.exc_value)
-        arcpy.AddError(pymsg)
-    finally:
-        arcpy.RefreshCatalog
-
-def transferAtts(inFC, joinTable, parentKey, childKey, fInfo, outName):
-    try:
-        #transfers attributes from a table to a fc: OIDs must match!
-        #get the attributes through a join which only works on a feature layer
-        lName = 'lay'
-        layer = arcpy.MakeFeatureLayer_management(inFC, lName)[0]
-
-        #before the join, set the QualifiedFieldNames environment setting so that
-        #we don't see the source table name as a prefix in the field names
-        arcpy.env.qualifiedFieldNames = False
-
-        #make the join based on key field
-        arcpy.AddJoin_management(lName, parentKey, joinTable, childKey)
-
-        #copy features out to the output name
-        arcpy.CopyFeatures_management(lName, outName)
-
-    except:
-        tb = sys.exc_info()[2]
-        tbinfo = traceback.format_tb(tb)[0]
-        pymsg = tbinfo + '\n' + str(sys.exc_type)+ ': ' + str(sys.exc_value)
-        arcpy.AddError(pymsg)
-
-
-def plan2side(ZMlines, ve):
-    #flip map view lines to cross section view without creating a copy
-    #this function updates the existing geometry
-    arcpy.AddMessage('Flipping ' + ZMlines + ' from map view to  cross section view')
-    try:
-        rows = arcpy.UpdateCursor(ZMlines)
-        n = 0
-        for row in rows:
-            # Create the geometry object
-            feat = row.shape
-            new_Feat_Shape = arcpy.Array()
-            a = 0
-            while a < feat.partCount:
-                # Get each part of the geometry)
-                array = feat.getPart(a)
-                newarray = arcpy.Array()
-
-                # otherwise get the first point in the array of points
-                pnt = array.next()
-
-                while pnt:
-                    pnt.X = float(pnt.M)
-                    pnt.Y = float(pnt.Z) * float(ve)
-
-                    #Add the modified point into the new array
-                    newarray.add(pnt)
-                    pnt = array.next()
-
-                #Put the new array into the new feature  shape
-                new_Feat_Shape.add(newarray)
-                a = a + 1
-
-            #Update the row object's shape
-            row.shape = new_Feat_Shape
-
-            #Update the feature's information in the workspace using the cursor
-            rows.updateRow(row)
-    except:
-        tb = sys.exc_info()[2]
-        tbinfo = traceback.format_tb(tb)[0]
-        pymsg = tbinfo + '\n' + str(sys.exc_type)+ ': ' + str(sys.exc_value)
-        arcpy.AddError(pymsg)
-        raise SystemError
-
 # PARAMETERS
 # ***************************************************************
 arcpy.env.overwriteOutput = True
@@ -167,6 +83,45 @@ appendFC = arcpy.GetParameterAsText(8)
 #data frame name
 dfName = arcpy.GetParameterAsText(9)
 
+#parameter 10 is the derived output layer
+
+#DEM sampling method - NEAREST, BILINEAR, or CUBIC
+method = xsec_defs.optionalParameter(11, 'BILINEAR')
+
+#sampling interval along the lines, in map units; blank samples at the
+#cell size of the DEM
+interval = float(xsec_defs.optionalParameter(12, 0))
+
+#vertical tolerance, in elevation units, for simplifying the profiles;
+#blank or 0 keeps every sampled vertex
+tolerance = float(xsec_defs.optionalParameter(13, 0))
+
+#preview resolution - the approximate cell size, in map units, to sample
+#from a decimated overview of the DEM while trying out section lines.
+#blank samples the DEM at full resolution
+preview = float(xsec_defs.optionalParameter(14, 0))
+
+#swath half-width - summarize the surface across a corridor this many map
+#units either side of each line. blank or 0 samples along the line only
+swathWidth = float(xsec_defs.optionalParameter(15, 0))
+
+#percentiles to report for a swath, in addition to the min, mean, and max,
+#as a semicolon-delimited list, e.g. 25;75
+percentiles = [float(q) for q in xsec_defs.optionalParameter(16, '').split(';') if not q.strip() == '']
+
+#horizons - additional surface rasters, e.g. structure contour grids, to
+#sample at the same positions as the DEM. One profile is made per raster
+#and tagged with the raster name in a Horizon field
+horizons = [h.strip().strip("'") for h in xsec_defs.optionalParameter(17, '').split(';') if not h.strip() == '']
+
+#memory budget, in megabytes, for DEM cells and sample points held at once;
+#blank uses the default of xsec_dem
+memoryBudget = float(xsec_defs.optionalParameter(18, 0))
+
+#measure mode and plane azimuth - how distance along the section, X in
+#cross-section view, is measured; see xsec_defs.measureParameters
+measureMode, azimuth = xsec_defs.measureParameters(19, 20)
+
 # BEGIN
 # ***************************************************************
 #do we have a place to put this?
@@ -174,6 +129,12 @@ try:
     if outFC == "" and appendFC == "":
         arcpy.AddError("Provide the name of a new feature class or one to which the features will be appended.")
         raise SystemError
+
+    xsec_defs.checkMeasureMode(measureMode)
+
+    if swathWidth > 0 and horizons:
+        arcpy.AddError("Swath profiles can only be made from one surface; clear either the swath width or the horizons.")
+        raise SystemError
     
     #check the availability of the 3d Analyst extension
     checkExtensions()
@@ -211,93 +172,127 @@ try:
     scratchDir = arcpy.env.scratchWorkspace
     arcpy.env.workspace = scratchDir
 
-    #add an rkey field to the table that consists of values from the OID
-    desc = arcpy.Describe(linesLayer)
-    idField = desc.OIDFieldName
-    addAndCalc(linesLayer, 'ORIG_FID', '[' + idField + ']')
-    
-    #interpolate the lines
-    zLines = outName + '_z'
+    #sample the DEM along all of the lines at once. The vertices of every line
+    #are packed into one array, densified, sampled, and measured in single
+    #vectorized steps instead of going through InterpolateShape, CreateRoutes,
+    #and a join one feature class at a time
     arcpy.AddMessage('Getting elevation values for features in ' + linesLayer)
-    arcpy.InterpolateShape_3d(dem, linesLayer, zLines)
-    arcpy.AddMessage('    ' + zLines + ' written to ' + arcpy.env.scratchWorkspace)
-    
-    #measure the lines
-    zmLines = outName + '_zm'
-    arcpy.AddMessage('Measuring the length of the line(s) in ' + zLines)
-    arcpy.CreateRoutes_lr(zLines, 'ORIG_FID', zmLines, 'LENGTH', '#', '#', cp)
-    arcpy.AddMessage('    ' + zmLines + ' written to ' + arcpy.env.scratchWorkspace)
-    
-    #hook the attributes back up
-    #transferAtts(inFC, joinTable, parentKey, childKey, fInfo, outName)
-    zmAtts = outName + '_zmAtts'
-    transferAtts(zmLines, linesLayer, 'ORIG_FID', 'ORIG_FID', '#', zmAtts)
+    if memoryBudget > 0:
+        xsec_dem.setMemoryBudget(memoryBudget)
+    surface = xsec_dem.openDEM(dem)
+    if preview > 0:
+        level = surface.previewLevel(preview)
+        if level > 0:
+            #overviews are built the first time they are asked for and
+            #saved next to the DEM for every run after that
+            xsec_dem.buildOverviews(surface, level)
+            surface = surface.overview(level)
+        arcpy.AddMessage('    preview profile from {} map unit cells'.format(surface.cellSize))
+    #the profile cache lasts the whole session, so count only the profiles
+    #this run reuses
+    cacheHits = xsec_dem.profileCache.hits
+    fields = xsec_lines.editableFields(linesLayer)
+    lines = xsec_lines.PackedLines.fromLayer(linesLayer, fields, surface.sr)
+
+    #reverse lines as needed so that measures start from the corner
+    #chosen by the coordinate priority
+    lines.orient(cp)
+    if swathWidth > 0:
+        #a swath profile summarizes the surface across a corridor on either
+        #side of the line instead of sampling along the line itself. Each
+        #statistic becomes its own profile, tagged in the SwathStat field
+        arcpy.AddMessage('    summarizing the surface {} map units either side of the lines'.format(swathWidth))
+        tagField = 'SwathStat'
+        profiles = xsec_dem.swathProfiles(surface, lines, swathWidth, method, interval or None, percentiles, measureMode, azimuth)
+    elif horizons:
+        #the lines are densified and measured once and every horizon is
+        #sampled at the same vertices
+        tagField = 'Horizon'
+        surfaces = [surface] + [xsec_dem.openDEM(h) for h in horizons]
+        arcpy.AddMessage('    sampling {} surfaces at the same vertices'.format(len(surfaces)))
+        zmLines = xsec_dem.profileSurfaces(surfaces, lines, method, interval or None, cp, measureMode, azimuth)
+        profiles = [(s.name, z) for s, z in zip(surfaces, zmLines)]
+    elif interval > 0:
+        tagField = None
+        zmLines = xsec_dem.profileLines(surface, lines, method, interval, cp, measureMode, azimuth)
+        #compare the vertices actually sampled with the number a profile at
+        #the cell size would have had
+        arcpy.AddMessage('    sampled {} vertices every {} map units, {} at the cell size of {}'.format(
+            len(zmLines.coords), interval, lines.densifiedCount(surface.cellSize), surface.cellSize))
+        profiles = [(None, zmLines)]
+    else:
+        tagField = None
+        profiles = [(None, xsec_dem.profileLines(surface, lines, method, cp=cp, mode=measureMode, azimuth=azimuth))]
 
-    #make an empty container with an 'Unknown' SR
-    zmProfiles = outName + '_profiles'
-    arcpy.CreateFeatureclass_management(scratchDir, zmProfiles, 'POLYLINE', linesLayer, 'ENABLED', 'ENABLED')
-    arcpy.Append_management(zmAtts, zmProfiles, 'NO_TEST')
-    plan2side(zmProfiles, ve)
+    reused = xsec_dem.profileCache.hits - cacheHits
+    if reused > 0:
+        arcpy.AddMessage('    profiles sampled from {} surfaces reused from an earlier run'.format(reused))
 
     #check plotWRT boolean
     if plotWRT == 'true':
+        #find where every profile crosses the single line before the
+        #profiles are split at NoData and simplified, which would move or
+        #drop the bends of the lines in map view. The lines in map view are
+        #the same for every statistic of a swath or every horizon, so the
+        #first set is used to find the crossings
+        arcpy.AddMessage('Locating the intersections of ' + linesLayer + ' with ' + wrtLineFC)
+        routes = xsec_routes.Routes(profiles[0][1], None, surface.sr)
+        wrtLines = xsec_lines.PackedLines.fromLayer(wrtLineFC, sr=surface.sr)
+        feature, m = routes.intersect(wrtLines)
+
+        #the first crossing of each profile is the offset required to plot
+        #it wrt the intersecting line; profiles that don't cross it keep
+        #their measures
+        first = np.ones(len(feature), bool)
+        first[1:] = feature[1:] != feature[:-1]
+        offsets = np.zeros(routes.lines.nFeatures)
+        offsets[feature[first]] = -m[first]
+        arcpy.AddMessage('    {} of {} profiles shifted to the intersection'.format(first.sum(), len(offsets)))
+
+    for i, (tag, zmLines) in enumerate(profiles):
+        #vertices off the DEM or over NoData are dropped and the profile is
+        #split into separate parts on either side of the gap
+        zmLines = zmLines.split(~np.isnan(zmLines.coords[:, 2]))
+        arcpy.AddMessage('    {} vertices sampled along {} lines'.format(len(zmLines.coords), zmLines.nFeatures))
+
+        #thin out the vertices that don't change the shape of the profile
+        #at this vertical exaggeration
+        if tolerance > 0:
+            nSampled = len(zmLines.coords)
+            zmLines = zmLines.simplifyProfile(tolerance, ve)
+            arcpy.AddMessage('    simplifying with a vertical tolerance of {} removed {} vertices'.format(tolerance, nSampled - len(zmLines.coords)))
+        profiles[i] = (tag, zmLines)
+
+    if plotWRT == 'true':
+        #re-zero every profile at the point where it crosses the single line
+        profiles = [(tag, xsec_routes.Routes(zmLines, None).shift(offsets).lines)
+                    for tag, zmLines in profiles]
 
-        #create points that represent the intersections between the profile lines
-        #and the single intersection line
-        intersectFC = outName + '_intersectPts'
-        arcpy.Intersect_analysis([linesLayer, wrtLineFC], intersectFC, '#', '#', 'POINT')
-
-        #now, locate those points on the profile routes
-        #a field called 'mValue' will be created that shows the distance
-        #from the beginning of the profile line to the point of intersection
-        #the offset required to plot the profile wrt to the intersecting line
-        intersectTab = outName + '_intersectTab'
-        rProps = 'rkey POINT mValue'
-        arcpy.AddMessage('Locating ' + linesLayer + ' on ' + zmLines)
-        arcpy.LocateFeaturesAlongRoutes_lr(intersectFC, zmLines, 'ORIG_FID', 1, intersectTab, rProps, 'FIRST', 'NO_DISTANCE', 'NO_ZERO')
-
-        #now update the profiles
-        profiles = arcpy.UpdateCursor(zmProfiles)
-
-        maxY = 0
-        minY = 0
-        for profile in profiles:
-            #get the offset for this profile
-            #first, get the route key of this profile
-            rte = profile.ORIG_FID
-            if not rte == None:
-                #and create a search cursor of hopefully just one row where the rkeys
-                #in the profiles fc and the intersect table are the same
-                where = '"rkey" = ' + str(rte)
-                #rows = arcpy.SearchCursor(intersectTab, where)
-                with arcpy.da.SearchCursor(intersectTab, "mValue", where) as rows:
-                    try:
-                        #get the offset distance
-                        #offset = rows.next().mValue
-                        offset = rows.next()[0]
-        
-                        #create an empty container for the re-calced profile geometry
-                        newProf = arcpy.CreateObject('array')
-        
-                        #get the existing geometry
-                        feat = profile.shape
-                        part = feat.getPart(0)
-        
-                        for pnt in part:
-                            #recalc each x coordinate and add it to the new array object
-                            pnt.X = pnt.X - offset
-                            newProf.add(pnt)
-        
-                            #compare Y values for the min and max of the dataset
-                            if pnt.Y > maxY: maxY = pnt.Y
-                            if pnt.Y < minY: minY = pnt.Y
-        
-                        #set the old profile shape to the new and update
-                        profile.shape = newProf
-                        profiles.updateRow(profile)
-                    except:
-                        pass 
+    #the profiles are flipped to cross-section view, M for X and Z times ve
+    #for Y, in one pass over the vertices as they are written
+    toSection = xsec_transform.Affine.sideView(ve)
 
+    #make an empty container with an 'Unknown' SR
+    zmProfiles = outName + '_profiles'
+    arcpy.CreateFeatureclass_management(scratchDir, zmProfiles, 'POLYLINE', linesLayer, 'ENABLED', 'ENABLED')
+    if tagField:
+        arcpy.AddField_management(zmProfiles, tagField, 'TEXT', '#', '#', 64)
+    #the exaggeration is recorded so the profiles can be redrawn at another
+    #one from the elevations kept in Z
+    xsec_transform.addSectionFields(zmProfiles)
+    arcpy.AddMessage('Flipping the profiles from map view to cross section view')
+    for tag, zmLines in profiles:
+        if tagField:
+            zmLines = zmLines.withAttribute(tagField, tag)
+        zmLines = zmLines.withAttribute(xsec_transform.VE_FIELD, float(ve))
+        zmLines = zmLines.withCoords(toSection(zmLines.coords))
+        xsec_lines.insertLines(zmProfiles, zmLines, hasZ=True, hasM=True)
+
+    if plotWRT == 'true':
+        #the range of the profiles in cross-section view, for the marker line
+        z = np.concatenate([zmLines.coords[:, 2] for tag, zmLines in profiles] + [[0.0]])
+        minY = float(z.min()) * float(ve)
+        maxY = float(z.max()) * float(ve)
 
         #now insert one last vertical line to show the location of intersection
         rows = arcpy.InsertCursor(zmProfiles)
@@ -311,26 +306,27 @@ try:
         #update the properties of the objects
         pnt1.X = 0
         pnt1.Y = (minY - 500.0)
+        pnt1.Z = pnt1.Y / float(ve)
         lineArray.add(pnt1)
 
         pnt2.X = 0
         pnt2.Y = (maxY + 500.0)
+        pnt2.Z = pnt2.Y / float(ve)
         lineArray.add(pnt2)
 
         #add the new feature
         row.shape = lineArray
+        row.setValue(xsec_transform.VE_FIELD, float(ve))
         rows.insertRow(row)
 
     #some cleanup
-    arcpy.DeleteField_management(zmProfiles, 'ORIG_FID')
-    arcpy.DeleteField_management(linesLayer, 'ORIG_FID')
     arcpy.SelectLayerByAttribute_management(linesLayer, "CLEAR_SELECTION")
-    arcpy.Delete_management("lay")
 
     #now, to worry about the output
     #check to see if we are to append the features to an existing fc
     if appendBool == 'true':
         arcpy.AddMessage('Appending features to ' + appendFC)
+        xsec_transform.addSectionFields(appendFC)
         arcpy.Append_management(zmProfiles, appendFC)
         outLayer = appendFC
 
@@ -21,10 +21,14 @@ Edits beginning 7/31/13 to upgrade to 10.1 and eliminate references to xsecdefs
 
 import os
 import sys
+import json
+import numpy as np
 import arcpy
 import traceback
 import xsec_defs
-import bisect
+import xsec_dem
+import xsec_routes
+import xsec_transform
 
 # FUNCTIONS
 # *******************************************************
@@ -47,29 +51,6 @@ def getCPValue(quadrant):
 
     return cpDict[quadrant]
 
-def addAndCalc(layer, field, calc):
-    #adds a field to a table (layer) of name (field), and calcs a value
-    #created as means to add an rkey value to line layers that consist
-    #of OID values
-    try:
-        #add a key field if it doesn't already exist
-        if len(arcpy.ListFields(layer, field)) ==0:
-            arcpy.AddField_management(layer, field, 'LONG')
-
-		#calculate the id value over to the new value so we always have it in the table
-		#as it goes through it's various transformations, some of which will re-write
-		#the id field.
-        arcpy.CalculateField_management(layer, field, calc)
-
-    except:
-        tb = sys.exc_info()[2]
-        tbinfo = traceback.format_tb(tb)[0]
-        pymsg = tbinfo + '\n' + str(sys.exc_type)+ ': ' + str(sys.exc_value)
-        arcpy.AddError(pymsg)
-        raise SystemError
-    finally:
-        arcpy.RefreshCatalog
-
 def addZ(ZptLayer):
     #adds the z value to the table so that it is in the event table when we locate
     #points along the line route
@@ -97,95 +78,10 @@ def addZ(ZptLayer):
 		arcpy.AddError(pymsg)
 		raise SystemError
 
-def vertexDictionary(ZMline):
-    '''creates a dictionary of the geometry
-    values of each vertex in an interpolated and measured
-    line. Also creates a list of just the elevations'''
-    try:
-        #create the collection containers
-        vDict = {}
-        vList = []
-
-        #create search cursor
-        wkt = arcpy.da.SearchCursor(ZMline, ["SHAPE@WKT"]).next()[0]
-        wkt = wkt[wkt.find("((") + 2: wkt.find("))")]
-        vtxList = wkt.split(", ")
-        for vtx in vtxList:
-            valList = vtx.split(" ")
-            x = float(valList[0])
-            y = float(valList[1])
-            m = float(valList[3])
-            vDict[m] = (x, y)
-            vList.append(m)
-			
-        #for k in vDict.keys():
-        #    arcpy.AddMessage("{}, {}".format(k, vDict[k]))
-        #sort the list numerically so we know we are evaluating m values
-        #from min to max
-        vList.sort()
-
-        return vList, vDict
-
-    except:
-        tb = sys.exc_info()[2]
-        tbinfo = traceback.format_tb(tb)[0]
-        pymsg = tbinfo + '\n' + str(sys.exc_type)+ ': ' + str(sys.exc_value)
-        arcpy.AddError(pymsg)
-        raise SystemError
-    
-def lerpXY(distance, vList, vDict):
-    '''lerp, apparently, is a verb meaning 'to perform a linear interpolation'
-    Use the very handy bisect module to find where the distance (as reported
-    by the X coordinate in cross section view) would be inserted in the
-    sorted M values list.'''
-    #arcpy.AddMessage("{}, {}".format(distance, min(vList)))
-    try:
-        #if our distance value is smaller than the M value at the beginning
-        #of the line, use the smallest M value as the key for the dictionary
-        #and use the XY of that entry, no interpolation
-        if distance <= min(vList):
-            #arcpy.AddMessage("{}, {}".format(distance, min(vList)))
-            #arcpy.AddMessage(1)
-            key = min(vList)
-            newX = vDict[key][0]
-            newY = vDict[key][1]
-
-        #if our distance value is larger than the M value at the end of the line
-        #use the largest M value of the key for the dictionary and use the XY
-        #of that entry, no interpolation
-        elif distance >= max(vList):
-            #arcpy.AddMessage(2)
-            key = max(vList)
-            newX = vDict[key][0]
-            newY = vDict[key][1]
-
-        #otherwise, find the bracketing M-value pair for our distance and
-        #interpolate the XY coordinates
-        else:
-            #bisect returns the index
-            #arcpy.AddMessage('trying')
-            #arcpy.AddMessage(3)
-            insertN = bisect.bisect_right(vList, distance)
-
-            floor = vList[insertN - 1]
-            ceiling = vList[insertN]
-
-            floorX = vDict[floor][0]
-            floorY = vDict[floor][1]
-            ceilingX = vDict[ceiling][0]
-            ceilingY = vDict[ceiling][1]
-
-            vFactor = (distance - floor) / (ceiling - floor)
-
-            newX = floorX + (vFactor * (ceilingX - floorX))
-            newY = floorY + (vFactor * (ceilingY - floorY))
-
-    except:
-        #if the try block fails, skip the point
-        newX = 9999
-        newY = 9999
-
-    return newX, newY
+def isOuterRing(ring):
+    #outer rings of Esri polygons run clockwise, holes counterclockwise
+    xy = np.array(ring, 'f8')[:, :2]
+    return (xy[:-1, 0] * xy[1:, 1] - xy[1:, 0] * xy[:-1, 1]).sum() <= 0
 
 def returnParentFolder(path):
      desc = arcpy.Describe(path)
@@ -249,6 +145,8 @@ if int(result.getOutput(0)) > 1:
     arcpy.AddError(xsecLayer + ' has more than one line in it.')
     
 # elevation raster layer
+#only used when the section was measured in 3D, since otherwise the line is
+#measured without interpolating Z values
 dem = arcpy.GetParameterAsText(1)
 
 #coordinate priority - corner from which the measuring will begin
@@ -264,10 +162,16 @@ ve = arcpy.GetParameterAsText(4)
 # output directory
 outDir = arcpy.GetParameterAsText(5)
 
+#measure mode and plane azimuth - how distance along the section, X in
+#cross-section view, is measured; see xsec_defs.measureParameters
+measureMode, azimuth = xsec_defs.measureParameters(6, 7)
+
 
 #BEGIN
 #*******************************************************
 try:  
+    xsec_defs.checkMeasureMode(measureMode)
+
     #check for 3DAnalyst extension
     checkExtensions()
 
@@ -285,39 +189,30 @@ try:
     #scratchDir = r"D:\Current\Publications_Reviews\H\Haeussler_Kodiak\Kodiak_SIM\geologic_data"
     arcpy.env.workspace = scratchDir
     
-    #add an rkey field to the table that consists of values from the OID
-    desc = arcpy.Describe(xsecLayer)
-    idField = desc.OIDFieldName
-    addAndCalc(xsecLayer, 'ORIG_FID', '[' + idField + ']')
-
-    #interpolate the line to add z values
-    #despite the documentation for InterpolateShape, the function may not deal
-    #appropriately with spatial references that differ between the features and the surface
-    #particularly if one is UTM and one is state plane in feet
-    #the user may have to re-project the surface to the same as the features
-    #should this be a fatal error with a warning?
-    zLine = xsecName + '_z'
-    arcpy.AddMessage('Getting elevation values for cross-section line in ' + xsecLayer)
-    arcpy.InterpolateShape_3d(dem, xsecLayer, zLine)
-    arcpy.AddMessage('    ' + zLine + ' written to ' + scratchDir)
-
-    #measure the line
-    zmLine = xsecName + '_zm'
-    arcpy.AddMessage('Measuring the length of the line in ' + zLine)
-    arcpy.CreateRoutes_lr(zLine, 'ORIG_FID', zmLine, 'LENGTH', '#', '#', cp)
-    arcpy.AddMessage('    ' + zmLine + ' written to ' + scratchDir)
-
-    #load the coordinates of the vertices into a dictionary and a list of M values
-    dl = vertexDictionary(zmLine)
-    vList = dl[0]
-    vDict = dl[1]
+    #measure the line into a route. Only the XY and M values of the route
+    #are needed to place the cross section features back in map view, so
+    #the line only goes through the DEM when the section was measured in 3D;
+    #otherwise its measures are the same 2D (or CHORD) lengths the profile had
+    arcpy.AddMessage('Measuring the length of the line in ' + xsecLayer)
+    if measureMode == '3D':
+        routes = xsec_dem.profileRoutes(dem, xsecLayer, 'OID@', cp, mode=measureMode, azimuth=azimuth)
+    else:
+        routes = xsec_routes.sectionRoutes(xsecLayer, cp, measureMode, azimuth)
+
+    #the M values and map coordinates of the vertices of the line, for
+    #xsec_defs.lerpXYs
+    m = routes.m
+    xy = routes.lines.coords[:, :2]
     
     #all output classes need to be Z-aware
     arcpy.env.outputZFlag = 'Enabled'
     
     #write all copies out to the SR of the cross section line
-    desc = arcpy.Describe(zmLine)
-    arcpy.OutputCoordinateSystem = desc.SpatialReference
+    arcpy.OutputCoordinateSystem = routes.sr
+
+    #the elevation of every vertex is its Y in cross-section view without
+    #the vertical exaggeration
+    toMap = xsec_transform.Affine.elevation(ve)
 
     for layer in featList:
         arcpy.AddMessage('Converting %s to 3D features' % layer)
@@ -335,34 +230,33 @@ try:
         #special case of point feature type (fewer nested loops for the parts > vertices)
         #and we can edit the geometry directly
         if shpType == 'Point':
+            #read the cross-section view coordinates of all of the points,
+            #find their map coordinates and elevations at once, and then
+            #write them back to the copy
+            oids = []
+            xsXY = []
+            for row in arcpy.da.SearchCursor(layCopy, ["OID@", "SHAPE@XY"]):
+                oids.append(row[0])
+                xsXY.append(row[1])
+            coords = toMap(xsec_transform.widen(np.array(xsXY, 'f8').reshape(-1, 2), [0, 1]))
+            newX, newY, inRange = xsec_defs.lerpXYs(coords[:, 0], m, xy)
+            newXYZ = dict(zip(oids, zip(newX.tolist(), newY.tolist(), coords[:, 2].tolist())))
+
             #open an update cursor on the copy
-            rows = arcpy.da.UpdateCursor(layCopy, ["SHAPE@XY", "SHAPE@Z"])
-            
+            rows = arcpy.da.UpdateCursor(layCopy, ["OID@", "SHAPE@XY", "SHAPE@Z"])
             for row in rows:
-                #get the geometry of this point
-                oldXY = row[0]
-                oldX = oldXY[0]
-                oldY = oldXY[1]
-                
-                #get the XY of this point based on the M value
-                xDistance = oldX
-                newXY = lerpXY(xDistance, vList, vDict)
-                newX = newXY[0]
-                newY = newXY[1]
-                newPnt = arcpy.CreateObject('Point')
-                
-                arcpy.AddMessage('old :' + str(oldX) + ', ' + str(oldY))
-                arcpy.AddMessage('new :' + str(newXY[0]) + ', ' + str(newXY[1]) + ', ' + str(oldY / float(ve)))
-                
-                #write the coordinates to the new point
-                #newX = newXY[0]
-                #newY = newXY[1]
-                newZ = (oldY / float(ve))
-                
+                newX, newY, newZ = newXYZ[row[0]]
+                #a point without a location is left where it is
+                if np.isnan(newX) or np.isnan(newZ):
+                    arcpy.AddMessage('    No location for OBJECTID ' + str(row[0]))
+                    continue
+
                 #update the row's shape
-                row[0] = [newX, newY]
-                row[1] = newZ
+                row[1] = [newX, newY]
+                row[2] = newZ
                 rows.updateRow(row)
+            del rows
+            nBeyond = (~inRange & ~np.isnan(coords[:, 0])).sum()
                 
         else: #we're dealing with lines or polygons which are not so easy to edit
             #get the parent folder of the scratch directory, might be a folder
@@ -376,9 +270,10 @@ try:
 			
 			#ID list
             idl = []
+            nBeyond = 0
             
             #open a search cursor
-            rows = arcpy.da.SearchCursor(layCopy, ["OID@", "SHAPE@"])
+            rows = arcpy.da.SearchCursor(layCopy, ["OID@", "SHAPE@JSON"])
             
             #start looping through the features
             for row in rows:
@@ -388,37 +283,25 @@ try:
                 #arcpy.AddMessage("OBJECTID {}".format(row[0]))
 				
                 #get the shape of each feature
-                feat = row[1]
-                              
-                #this might be a multipart feature
-                #if there is only one part, the next loop is only visited once
-                partnum = 0
-                partcount = feat.partCount
-                
-                while partnum < partcount:
-                    #put the points of this part into an array
-                    part = feat.getPart(partnum)
-    
-                    #get each vertex
-                    pnt = part.next()
-                    pntcount = 0
-    
-                    while pnt:
-                        #get the XY of this point from the vertex dictionary based on the M value
-                        xDistance = pnt.X
-                        newXY = lerpXY(xDistance, vList, vDict)
-                        
-                        #if we can get valid coordinates from lerpXY
-                        if not newXY[0] == 9999:
-                            outF.write(str(newXY[0]) + ' ' + str(newXY[1]) + ' ' + str(pnt.Y / float(ve)) + '\n')
-                        else:
-                            arcpy.AddMessage('9999 exception with ' + str(row[0]) + ' : ' + str(pnt.X))
-                            
-                        #otherwise just go on to the next point
-                        pnt = part.next()
-                        
-                    #put the array of vertices into the row array
-                    partnum += 1
+                shape = json.loads(row[1])
+
+                #this might be a multipart feature. The vertices of each part
+                #are read as one array and their elevations found at once.
+                #Holes in polygons are left out
+                parts = shape.get('paths') or [r for r in shape.get('rings', []) if isOuterRing(r)]
+                for part in parts:
+                    coords = toMap(xsec_transform.widen(np.array(part, 'f8')[:, :2], [0, 1]))
+
+                    #get the XY of every vertex of the part based on the M value
+                    newX, newY, inRange = xsec_defs.lerpXYs(coords[:, 0], m, xy)
+                    good = ~np.isnan(newX)
+                    nBeyond += (~inRange & good).sum()
+
+                    #write the vertices we can get valid coordinates for
+                    for newXYZ in zip(newX[good].tolist(), newY[good].tolist(), coords[good, 2].tolist()):
+                        outF.write('{} {} {}\n'.format(*[str(v) for v in newXYZ]))
+                    for xDistance in coords[~good, 0].tolist():
+                        arcpy.AddMessage('    No location for ' + str(row[0]) + ' : ' + str(xDistance))
                 
                 #update the row's shape
                 outF.write('END\n')
@@ -448,6 +331,11 @@ try:
             outPath = os.path.join(outDir, outName)			
             arcpy.CopyFeatures_management(srcFC, outPath)
 
+        #vertices past the ends of the line are flagged by lerpXYs and put
+        #at the nearest end
+        if nBeyond > 0:
+            arcpy.AddMessage('    {} vertices beyond the ends of {} placed at the nearest end'.format(nBeyond, xsecLayer))
+
         #raise SystemError   
 except:
     tb = sys.exc_info()[2]
@@ -20,7 +20,10 @@ import os
 import sys
 import traceback
 import bisect
+import numpy as np
 import arcpy
+import xsec_routes
+import xsec_transform
 
 '''traceback lines - copy this code into all except clauses. Can't seem to call it as a function
     tb = sys.exc_info()[2]
@@ -58,6 +61,39 @@ def getCPValue(quadrant):
 
     return cpDict[quadrant]
 
+def optionalParameter(index, default):
+    #parameters added to the end of the list after the toolbox was last
+    #saved won't be in older copies of the tool dialog; use the default
+    if arcpy.GetArgumentCount() > index:
+        value = arcpy.GetParameterAsText(index)
+        if not value == '':
+            return value
+    return default
+
+#ways of measuring distance along a section, X in cross-section view: 2D
+#(map distance), 3D (slope distance along the DEM), CHORD (distance along
+#the straight line between the ends of the section), or PLANE (distance
+#along a vertical plane that features are projected onto)
+MEASURE_MODES = ('2D', '3D', 'CHORD', 'PLANE')
+
+def measureParameters(modeIndex, azimuthIndex):
+    '''reads the measure mode parameter at modeIndex, one of MEASURE_MODES,
+    2D if it is blank, and the plane azimuth parameter at azimuthIndex, the
+    direction of the plane in PLANE mode in degrees clockwise from north,
+    None if it is blank to fit the plane to each section line.
+    Returns (mode, azimuth).'''
+    mode = optionalParameter(modeIndex, '2D').upper()
+    azimuth = optionalParameter(azimuthIndex, None)
+    if not azimuth is None:
+        azimuth = float(azimuth)
+    return mode, azimuth
+
+def checkMeasureMode(mode):
+    #stops the tool if mode is not one of MEASURE_MODES
+    if not mode in MEASURE_MODES:
+        arcpy.AddError('Measure mode must be one of 2D, 3D, CHORD, or PLANE.')
+        raise SystemError
+
 def cleanup(keepf, scratchDir):
     #clean out the scratch gdb
     arcpy.workspace = scratchDir
@@ -160,38 +196,8 @@ def plan2side(ZMlines, ve):
     #this function updates the existing geometry 
     arcpy.AddMessage('Flipping ' + ZMlines + ' from map view to cross-section view')
     try:
-        rows = arcpy.UpdateCursor(ZMlines)
-        n = 0
-        for row in rows:
-            # Create the geometry object
-            feat = row.shape
-            new_Feat_Shape = arcpy.Array()
-            a = 0
-            while a < feat.partCount:
-                # Get each part of the geometry)
-                array = feat.getPart(a)
-                newarray = arcpy.Array()
-                                                    
-                # otherwise get the first point in the array of points
-                pnt = array.next()
-                                    
-                while pnt:
-                    pnt.X = float(pnt.M)
-                    pnt.Y = float(pnt.Z) * float(ve)
-                                    
-                    #Add the modified point into the new array
-                    newarray.add(pnt)
-                    pnt = array.next()
-            
-                #Put the new array into the new feature  shape
-                new_Feat_Shape.add(newarray)
-                a = a + 1
-                                
-            #Update the row object's shape  
-            row.shape = new_Feat_Shape
-                
-            #Update the feature's information in the workspace using the cursor
-            rows.updateRow(row)
+        n = xsec_transform.plan2side(ZMlines, ve)
+        arcpy.AddMessage('    {} vertices flipped'.format(n))
     except:
         tb = sys.exc_info()[2]
         tbinfo = traceback.format_tb(tb)[0]
@@ -373,34 +379,14 @@ def zPoints2XSec (outName, Zpts, eventTable, ZField, ve, scratchDir):
         arcpy.AddError(pymsg)
         raise SystemError
 
-def placeEvents(inRoutes, idRteFld, eventTable, eventRteFld, fromVar, toVar, eventLay):
-    #place events along routes, creates a temporary layer
+def placeEvents(routes, eventTable, eventRteFld, fromVar, toVar, eventLay):
+    #place line events along an xsec_routes.Routes object and save them to
+    #eventLay, leaving out unlocated and zero-length events
     try:
-		arcpy.AddMessage('Placing line events on ' + inRoutes)
-		props = eventRteFld + ' LINE ' + fromVar + ' ' + toVar
-		
-		#this makes an event layer where the table includes all records even if they were not located
-		#on any routes
-		arcpy.MakeRouteEventLayer_lr(inRoutes, idRteFld, eventTable, props, 'lyr')
-		arcpy.AddMessage(eventTable + ' written to temporary memory')
-		
-		#one way to select only events that were located on a valid route is to 
-		#save the layer to a feature class,
-		arcpy.CopyFeatures_management('lyr', 'lyr2')
-		
-		#...create an in-memory layer based on that feature class and limited to where
-		#Shape_Length <> 0,
-		arcpy.MakeFeatureLayer_management('lyr2', 'lyr3', "Shape_Length <> 0")
-		
-		#make a new selection
-		#arcpy.SelectLayerByAttribute_management('lyr2', "NEW_SELECTION", "Shape_Length <> 0")
-
-		arcpy.AddMessage('Saving temp layer to permanent memory')
-		 
-		#...and copy to the output feature class
-		arcpy.CopyFeatures_management('lyr3', eventLay)
-		arcpy.AddMessage(eventLay + ' written to ' + arcpy.env.scratchWorkspace)
-        
+        arcpy.AddMessage('Placing line events from ' + eventTable)
+        xsec_routes.placeEvents(routes, eventTable, eventRteFld, fromVar, toVar, eventLay)
+        arcpy.AddMessage(eventLay + ' written to ' + arcpy.env.scratchWorkspace)
+
     except:
         tb = sys.exc_info()[2]
         tbinfo = traceback.format_tb(tb)[0]
@@ -535,19 +521,20 @@ def lerpXY(distance, vList, vDict):
     #sorted M values list.
 
     try:
+        #vList is sorted, so the smallest and largest M values are at the ends
         #if our distance value is smaller than the M value at the beginning
         #of the line, use the smallest M value as the key for the dictionary
         #and use the XY of that entry, no interpolation
-        if distance <= min(vList):
-            key = min(vList)
+        if distance <= vList[0]:
+            key = vList[0]
             newX = vDict[key][0]
             newY = vDict[key][1]
 
         #if our distance value is larger than the M value at the end of the line
         #use the largest M value of the key for the dictionary and use the XY
         #of that entry, no interpolation
-        elif distance >= max(vList):
-            key = max(vList)
+        elif distance >= vList[-1]:
+            key = vList[-1]
             newX = vDict[key][0]
             newY = vDict[key][1]
 
@@ -578,6 +565,33 @@ def lerpXY(distance, vList, vDict):
 
     return newX, newY
 
+def lerpXYs(distances, m, xy):
+    '''lerpXY for a whole array of distances at once: the XY coordinates at
+    each distance along a line with vertex measures m and (n, 2) vertex
+    coordinates xy, interpolated with np.interp over the sorted measures.
+    As in lerpXY, a distance beyond an end of the line gets the XY of that
+    end, but it is also flagged False in the inRange mask. NaN distances,
+    or any distance on a line with no vertices, get NaN coordinates.
+    Returns x, y, inRange.'''
+    distances = np.asarray(distances, 'f8')
+    x = np.empty(distances.shape)
+    y = np.empty(distances.shape)
+    x.fill(np.nan)
+    y.fill(np.nan)
+    m = np.asarray(m, 'f8')
+    if len(m) == 0:
+        return x, y, np.zeros(distances.shape, bool)
+
+    order = np.argsort(m, kind='mergesort')
+    m = m[order]
+    xy = np.asarray(xy, 'f8')[order]
+    good = ~np.isnan(distances)
+    x[good] = np.interp(distances[good], m, xy[:, 0])
+    y[good] = np.interp(distances[good], m, xy[:, 1])
+    inRange = good.copy()
+    inRange[good] = (distances[good] >= m[0]) & (distances[good] <= m[-1])
+    return x, y, inRange
+
 def returnParentFolder(path):
      desc = arcpy.describe(path)
      while not desc.datatype == 'Folder':
@@ -0,0 +1,761 @@
+'''
+Name: xsec_dem.py
+Description: in-process sampling of a DEM (or any single band surface raster)
+    for the cross section tools. Replaces InterpolateShape_3d by reading the
+    raster cells under the section lines into NumPy arrays and interpolating
+    elevations for all of the vertices of a line in one vectorized call.
+Requirements: ArcGIS 10.1 or later (arcpy.da and the numpy that ships with it)
+Date: 10/18/26
+
+Usage: import xsec_dem
+
+       dem - path to, or layer name of, a raster surface
+       method - 'NEAREST', 'BILINEAR', or 'CUBIC', the same keywords
+           used by the 3D Analyst tools
+
+Cells are read from the raster in fixed size tiles. The first time a tile is
+needed it is saved as a .npy file in the scratch folder and from then on it is
+memory-mapped from there, so a batch of tools run over the same area reads
+each tile from the raster only once. The least recently used tiles are deleted
+from the scratch folder when the store grows past TILE_STORE_BYTES. Tiles in use are kept in one least
+recently used cache that is shared by every tool that imports this module in
+an ArcMap or Python session. Only the tiles under the points being sampled
+are ever read, so a section over a raster of any size needs memory for a
+handful of tiles; the cache and the blocks of points sampled at once are
+held to a memory budget (MEMORY_BUDGET, or see setMemoryBudget).
+
+For quick preview profiles, a DEM can have overviews: copies of the raster
+decimated by 2, 4, 8... (the 2 x 2 mean of the level below). They are built
+once with buildOverviews, saved as tiles in a folder next to the raster
+named <raster>_xsec_overviews, and sampled the same way as the full
+resolution cells.
+'''
+import os
+import math
+import hashlib
+import tempfile
+import collections
+import numpy as np
+import arcpy
+import xsec_lines
+import xsec_routes
+
+#number of cells needed around a sample location by each method
+HALO = {'NEAREST': 0, 'BILINEAR': 1, 'CUBIC': 2}
+
+#rows and columns in a tile
+TILE_SIZE = 512
+
+#default limit on the memory used for raster cells and for the working
+#arrays of the points being sampled; see setMemoryBudget
+MEMORY_BUDGET = 256 * 1024 * 1024
+
+#the budget can't be less than the tiles around one window being sampled
+MIN_BUDGET = 16 * TILE_SIZE * TILE_SIZE * 4
+
+#approximate bytes of working arrays for each point in a block of samples
+POINT_BYTES = 96
+
+#upper limit on the disk space used by the cache of sampled profiles
+PROFILE_CACHE_BYTES = 512 * 1024 * 1024
+
+#upper limit on the disk space used by the tile store in the scratch folder
+TILE_STORE_BYTES = 4 * 1024 * 1024 * 1024
+
+#why a sample has no elevation, as returned by DEM.sample and written to
+#STATUS_FIELD on points that were given elevations from a surface
+VALID = 0
+OFF_DEM = 1
+NODATA = 2
+STATUS = {OFF_DEM: 'OFF_DEM', NODATA: 'NODATA'}
+
+#status of points whose elevation came from a field in their own table
+#but that field was empty
+NO_Z = 'NO_Z'
+STATUS_FIELD = 'ZStatus'
+
+
+class TileCache(object):
+    '''least recently used cache of raster tiles, bounded by the total bytes
+    of the tiles it holds rather than by their number'''
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.nBytes = 0
+        self.tiles = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        #return the tile stored under key, calling load() to get it if
+        #it isn't in the cache
+        tile = self.tiles.pop(key, None)
+        if tile is None:
+            tile = load()
+            self.nBytes += tile.nbytes
+            self.misses += 1
+        else:
+            self.hits += 1
+        self.tiles[key] = tile
+        self.evict()
+        return tile
+
+    def evict(self):
+        #evict the least recently used tiles, but always keep the one
+        #most recently asked for
+        while self.nBytes > self.maxBytes and len(self.tiles) > 1:
+            oldKey, oldTile = self.tiles.popitem(last=False)
+            self.nBytes -= oldTile.nbytes
+
+    def resize(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.evict()
+
+    def clear(self):
+        self.tiles.clear()
+        self.nBytes = 0
+
+#three quarters of the budget goes to the tile cache and the rest to
+#the points being sampled
+tileCache = TileCache(MEMORY_BUDGET * 3 // 4)
+blockPoints = MEMORY_BUDGET // 4 // POINT_BYTES
+
+def setMemoryBudget(megabytes):
+    '''limits the memory, in megabytes, held for raster cells and sample
+    points at any one time, however large the raster or the number of
+    points. Raster cells are only ever read a tile at a time, from the
+    windows that the points fall in, so the budget bounds the peak memory
+    of sampling.'''
+    global blockPoints
+    budget = max(int(float(megabytes) * 1024 * 1024), MIN_BUDGET)
+    tileCache.resize(budget * 3 // 4)
+    blockPoints = budget // 4 // POINT_BYTES
+
+def scratchFolder(name):
+    #tiles and profiles are persisted in the geoprocessing scratch folder
+    #when there is one
+    try:
+        scratch = arcpy.env.scratchFolder
+    except:
+        scratch = None
+    if not scratch:
+        scratch = tempfile.gettempdir()
+    return os.path.join(scratch, name)
+
+def tileFolder():
+    return scratchFolder('xsec_tiles')
+
+#bytes of tiles saved to the tile store since it was last checked against
+#TILE_STORE_BYTES
+_tileBytesSaved = 0
+
+def tileSaved(nBytes):
+    #checks the size of the tile store after every eighth of its limit
+    #saved, rather than listing it after every tile
+    global _tileBytesSaved
+    _tileBytesSaved += nBytes
+    if _tileBytesSaved > TILE_STORE_BYTES // 8:
+        _tileBytesSaved = 0
+        evictTiles(TILE_STORE_BYTES)
+
+def evictTiles(maxBytes):
+    '''deletes the least recently used tiles of every raster in the tile
+    store until it fits in maxBytes. Tiles that can't be deleted, e.g.
+    because another tool has them memory-mapped, are skipped.'''
+    files = []
+    for folder, dirs, names in os.walk(tileFolder()):
+        for name in names:
+            if name.endswith('.npy') and not name.endswith('.tmp.npy'):
+                path = os.path.join(folder, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                files.append((info.st_mtime, info.st_size, path))
+    files.sort()
+    total = sum(f[1] for f in files)
+    for mtime, size, path in files:
+        if total <= maxBytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def overviewFolder(path):
+    #a folder next to the raster, or next to the gdb the raster is in
+    parent = os.path.dirname(path)
+    while parent and not os.path.isdir(parent):
+        parent = os.path.dirname(parent)
+    if os.path.splitext(parent)[1].lower() == '.gdb':
+        parent = os.path.dirname(parent)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(parent, name + '_xsec_overviews')
+
+def modifiedTime(path):
+    #rasters in a gdb are not files; use the time of the nearest parent
+    #that exists on disk
+    while path and not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return 0
+        path = parent
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+
+class DEM(object):
+    '''the properties of a raster surface and methods to read and sample
+    its cells as NumPy arrays. Cell values that are NoData are read as NaN.'''
+    def __init__(self, dem):
+        raster = arcpy.Raster(dem)
+        self.path = raster.catalogPath
+        self.name = raster.name
+        self.sr = raster.spatialReference
+        self.xMin = raster.extent.XMin
+        self.yMax = raster.extent.YMax
+        self.cellX = raster.meanCellWidth
+        self.cellY = raster.meanCellHeight
+        self.nCols = raster.width
+        self.nRows = raster.height
+        self.noData = raster.noDataValue
+        self.cellSize = min(self.cellX, self.cellY)
+
+        #identifies this version of this raster in the tile store, so that
+        #tiles from an edited or replaced raster are never reused
+        fp = (self.path, modifiedTime(self.path), self.xMin, self.yMax,
+              self.cellX, self.cellY, self.nCols, self.nRows)
+        self.key = hashlib.md5(repr(fp).encode('utf-8')).hexdigest()
+        self.tileDir = os.path.join(tileFolder(), self.key)
+        self.level = 0
+        self.overviews = {}
+
+    def overview(self, level):
+        '''returns this surface decimated by 2 ** level; level 0 is the
+        surface itself'''
+        if level <= 0:
+            return self
+        if level not in self.overviews:
+            self.overviews[level] = Overview(self.overview(level - 1))
+        return self.overviews[level]
+
+    def previewLevel(self, cellSize):
+        #the coarsest overview level with cells no bigger than cellSize,
+        #stopping while the overview is still more than one tile
+        level = 0
+        size = self.cellSize * 2
+        nCells = max(self.nRows, self.nCols) // 2
+        while size <= cellSize and nCells > TILE_SIZE:
+            level += 1
+            size *= 2
+            nCells //= 2
+        return level
+
+    def tiles(self):
+        #every (row, column) tile index of the raster
+        for ti in range((self.nRows - 1) // TILE_SIZE + 1):
+            for tj in range((self.nCols - 1) // TILE_SIZE + 1):
+                yield ti, tj
+
+    def toGrid(self, x, y):
+        #map coordinates to fractional row, column coordinates where
+        #whole numbers fall on cell centers
+        cols = (np.asarray(x, 'f8') - self.xMin) / self.cellX - 0.5
+        rows = (self.yMax - np.asarray(y, 'f8')) / self.cellY - 0.5
+        return rows, cols
+
+    def readCells(self, row0, col0, nRows, nCols):
+        #read a block of cells, row 0 at the top, straight from the raster
+        llc = arcpy.Point(self.xMin + col0 * self.cellX, self.yMax - (row0 + nRows) * self.cellY)
+        a = arcpy.RasterToNumPyArray(self.path, llc, nCols, nRows).astype('f4')
+        if self.noData is not None:
+            a[a == self.noData] = np.nan
+        return a
+
+    def loadTile(self, ti, tj):
+        #memory-map the tile from the tile store, creating it first if
+        #this is the first time it has been needed
+        tileFile = os.path.join(self.tileDir, '%d_%d.npy' % (ti, tj))
+        if os.path.exists(tileFile):
+            try:
+                tile = np.load(tileFile, mmap_mode='r')
+                os.utime(tileFile, None)
+                return tile
+            except (IOError, OSError, ValueError):
+                #deleted or evicted since it was found; read it again
+                pass
+
+        row0 = ti * TILE_SIZE
+        col0 = tj * TILE_SIZE
+        a = self.readCells(row0, col0, min(TILE_SIZE, self.nRows - row0), min(TILE_SIZE, self.nCols - col0))
+        try:
+            if not os.path.exists(self.tileDir):
+                os.makedirs(self.tileDir)
+            #write under a temporary name so a partly written tile is never
+            #memory-mapped by another tool
+            tmp = os.path.join(self.tileDir, '%d_%d.%d.tmp.npy' % (ti, tj, os.getpid()))
+            np.save(tmp, a)
+            if os.path.exists(tileFile):
+                #another tool saved it first
+                os.remove(tmp)
+            else:
+                os.rename(tmp, tileFile)
+                self.tileSaved(a.nbytes)
+            return np.load(tileFile, mmap_mode='r')
+        except (IOError, OSError):
+            #can't write to the tile store; keep the tile in memory only
+            return a
+
+    def tileSaved(self, nBytes):
+        #only the tile store in the scratch folder is limited in size
+        tileSaved(nBytes)
+
+    def tile(self, ti, tj):
+        return tileCache.get((self.key, ti, tj), lambda: self.loadTile(ti, tj))
+
+    def readWindow(self, row0, col0, nRows, nCols):
+        #assemble a block of cells, row 0 at the top, from the tiles it overlaps
+        a = np.empty((nRows, nCols), 'f4')
+        row1 = row0 + nRows
+        col1 = col0 + nCols
+        for ti in range(row0 // TILE_SIZE, (row1 - 1) // TILE_SIZE + 1):
+            for tj in range(col0 // TILE_SIZE, (col1 - 1) // TILE_SIZE + 1):
+                t = self.tile(ti, tj)
+                tRow = ti * TILE_SIZE
+                tCol = tj * TILE_SIZE
+                r0 = max(row0, tRow)
+                r1 = min(row1, tRow + t.shape[0])
+                c0 = max(col0, tCol)
+                c1 = min(col1, tCol + t.shape[1])
+                a[r0 - row0:r1 - row0, c0 - col0:c1 - col0] = t[r0 - tRow:r1 - tRow, c0 - tCol:c1 - tCol]
+        return a
+
+    def sample(self, x, y, method='BILINEAR', status=False):
+        '''interpolates the surface at arrays of x and y. Locations off the
+        raster or next to NoData cells return NaN. If status is True, an
+        array of VALID, OFF_DEM, or NODATA codes, one for each location, is
+        returned along with the elevations.
+
+        The points are grouped by the tile they fall in and each group is
+        sampled from a window of that tile plus the few cells around it that
+        the method needs, so the points can be spread over any part of the
+        raster without the whole extent being read at once.'''
+        method = method.upper()
+        if len(x) > blockPoints:
+            #sample a block of points at a time to bound the working arrays
+            blocks = [self.sample(x[i:i + blockPoints], y[i:i + blockPoints], method, status)
+                      for i in range(0, len(x), blockPoints)]
+            if status:
+                return np.concatenate([b[0] for b in blocks]), np.concatenate([b[1] for b in blocks])
+            return np.concatenate(blocks)
+
+        rows, cols = self.toGrid(x, y)
+        z = np.empty(len(rows))
+        z.fill(np.nan)
+        inside = np.flatnonzero((rows >= -0.5) & (rows <= self.nRows - 0.5) &
+                                (cols >= -0.5) & (cols <= self.nCols - 0.5))
+        if len(inside) == 0:
+            return (z, np.ones(len(z), 'i1') * OFF_DEM) if status else z
+
+        #the tile holding the cell each point is anchored to
+        halo = HALO[method]
+        shift = 0.5 if method == 'NEAREST' else 0.0
+        r = np.clip(np.floor(rows[inside] + shift).astype(int), 0, self.nRows - 1)
+        c = np.clip(np.floor(cols[inside] + shift).astype(int), 0, self.nCols - 1)
+        nTileCols = (self.nCols - 1) // TILE_SIZE + 1
+        tileId = (r // TILE_SIZE) * nTileCols + c // TILE_SIZE
+
+        #sort the points by tile so each tile is visited once
+        order = np.argsort(tileId, kind='mergesort')
+        tileId = tileId[order]
+        inside = inside[order]
+        breaks = np.concatenate(([0], np.flatnonzero(np.diff(tileId)) + 1, [len(tileId)]))
+        for k in range(len(breaks) - 1):
+            idx = inside[breaks[k]:breaks[k + 1]]
+            ti, tj = divmod(int(tileId[breaks[k]]), nTileCols)
+            row0 = max(ti * TILE_SIZE - halo, 0)
+            col0 = max(tj * TILE_SIZE - halo, 0)
+            row1 = min((ti + 1) * TILE_SIZE + halo, self.nRows)
+            col1 = min((tj + 1) * TILE_SIZE + halo, self.nCols)
+            a = self.readWindow(row0, col0, row1 - row0, col1 - col0)
+            z[idx] = sampleArray(a, rows[idx] - row0, cols[idx] - col0, method)
+
+        if status:
+            codes = np.ones(len(z), 'i1') * OFF_DEM
+            codes[inside] = np.where(np.isnan(z[inside]), NODATA, VALID)
+            return z, codes
+        return z
+
+
+class Overview(DEM):
+    '''a copy of a surface at half the resolution of the one below it. Cells
+    are the mean of the valid cells in each 2 x 2 block of the finer level
+    and are read, tiled, and cached the same way as the full resolution
+    raster, but the tiles are kept next to the raster instead of in the
+    scratch folder so that they are only ever built once.'''
+    def __init__(self, finer):
+        self.finer = finer
+        self.level = finer.level + 1
+        self.path = finer.path
+        self.name = finer.name
+        self.sr = finer.sr
+        self.xMin = finer.xMin
+        self.yMax = finer.yMax
+        self.cellX = finer.cellX * 2
+        self.cellY = finer.cellY * 2
+        self.nCols = (finer.nCols + 1) // 2
+        self.nRows = (finer.nRows + 1) // 2
+        self.noData = None
+        self.cellSize = min(self.cellX, self.cellY)
+        self.key = '%s_L%d' % (finer.key.split('_')[0], self.level)
+        self.tileDir = os.path.join(overviewFolder(self.path), self.key)
+        self.overviews = {}
+
+    def readCells(self, row0, col0, nRows, nCols):
+        #block mean of the cells of the finer level, ignoring NaN. Level 1
+        #reads the full resolution cells straight from the raster, so that
+        #building overviews never copies the whole raster to the tile store
+        a = np.empty((nRows * 2, nCols * 2), 'f4')
+        a.fill(np.nan)
+        fRows = min(nRows * 2, self.finer.nRows - row0 * 2)
+        fCols = min(nCols * 2, self.finer.nCols - col0 * 2)
+        if self.finer.level == 0:
+            a[:fRows, :fCols] = self.finer.readCells(row0 * 2, col0 * 2, fRows, fCols)
+        else:
+            a[:fRows, :fCols] = self.finer.readWindow(row0 * 2, col0 * 2, fRows, fCols)
+        blocks = a.reshape(nRows, 2, nCols, 2)
+        valid = ~np.isnan(blocks)
+        total = np.where(valid, blocks, 0).sum(axis=3).sum(axis=1)
+        count = valid.sum(axis=3).sum(axis=1)
+        out = np.empty((nRows, nCols), 'f4')
+        out.fill(np.nan)
+        has = count > 0
+        out[has] = total[has] / count[has]
+        return out
+
+    def tileSaved(self, nBytes):
+        #overviews are kept next to the raster and are never evicted
+        pass
+
+    def isBuilt(self):
+        return os.path.exists(os.path.join(self.tileDir, 'complete'))
+
+def buildOverviews(surface, levels):
+    '''builds and saves every tile of overview levels 1 through levels of
+    surface, skipping levels that have already been built'''
+    for level in range(1, levels + 1):
+        ov = surface.overview(level)
+        if ov.isBuilt():
+            continue
+        arcpy.AddMessage('    building overview level {} ({} map unit cells)'.format(level, ov.cellSize))
+        for ti, tj in ov.tiles():
+            ov.tile(ti, tj)
+        try:
+            open(os.path.join(ov.tileDir, 'complete'), 'w').close()
+        except (IOError, OSError):
+            pass
+
+_surfaces = {}
+
+def openDEM(dem):
+    '''returns the DEM object for dem, shared with every other caller in this
+    session that opened the same version of the same raster'''
+    surface = DEM(dem)
+    return _surfaces.setdefault(surface.key, surface)
+
+
+def _kernel(t, method):
+    '''returns the cell offsets and the (n, k) weights of each offset for the
+    fractional part t of the grid coordinates'''
+    if method == 'NEAREST':
+        return np.array([0]), np.ones((len(t), 1))
+    if method == 'BILINEAR':
+        return np.array([0, 1]), np.column_stack((1 - t, t))
+    #cubic convolution, a = -0.5
+    t2 = t * t
+    t3 = t2 * t
+    w = np.column_stack((-0.5 * t3 + t2 - 0.5 * t,
+                         1.5 * t3 - 2.5 * t2 + 1,
+                         -1.5 * t3 + 2 * t2 + 0.5 * t,
+                         0.5 * t3 - 0.5 * t2))
+    return np.array([-1, 0, 1, 2]), w
+
+def sampleArray(a, rows, cols, method='BILINEAR'):
+    '''interpolates the 2D array a at fractional rows and cols. Points that
+    fall outside the outer cell edges return NaN, as does any point that has
+    a NaN cell in its neighborhood.'''
+    method = method.upper()
+    rows = np.asarray(rows, 'f8')
+    cols = np.asarray(cols, 'f8')
+    nRows, nCols = a.shape
+    inside = (rows >= -0.5) & (rows <= nRows - 0.5) & (cols >= -0.5) & (cols <= nCols - 0.5)
+
+    if method == 'NEAREST':
+        r0 = np.floor(rows + 0.5)
+        c0 = np.floor(cols + 0.5)
+    else:
+        r0 = np.floor(rows)
+        c0 = np.floor(cols)
+    rOff, rW = _kernel(rows - r0, method)
+    cOff, cW = _kernel(cols - c0, method)
+    r0 = r0.astype(int)
+    c0 = c0.astype(int)
+
+    #edge cells are repeated so that points in the outer half of a
+    #border cell still get a value
+    z = np.zeros(len(rows))
+    for i in range(len(rOff)):
+        ri = np.clip(r0 + rOff[i], 0, nRows - 1)
+        for j in range(len(cOff)):
+            cj = np.clip(c0 + cOff[j], 0, nCols - 1)
+            z += rW[:, i] * cW[:, j] * a[ri, cj]
+    z[~inside] = np.nan
+    return z
+
+class ProfileCache(object):
+    '''sampled and measured profiles saved to disk so that running a tool
+    again on the same lines, or another tool on those lines, skips sampling
+    the DEM. A profile is found by a hash of the line vertices, the version
+    of the surface (path, modified time, extent, cell size), the method, the
+    sampling interval, the coordinate priority, and the measure mode and
+    azimuth, so any change to those makes a new profile. Profiles measured
+    along another surface also carry the key of that surface's profile. The
+    least recently used profiles are deleted when the cache is over
+    maxBytes.'''
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+
+    def folder(self):
+        return scratchFolder('xsec_profiles')
+
+    def key(self, lines, surface, method, step, cp, mode='2D', azimuth=None, measuredOn=None):
+        h = hashlib.md5()
+        for a in (lines.coords[:, :2], lines.partStart, lines.partFeature):
+            h.update(np.ascontiguousarray(a, 'f8').tostring())
+        h.update(repr((surface.key, method.upper(), float(step), cp, mode, azimuth, measuredOn)).encode('utf-8'))
+        return h.hexdigest()
+
+    def load(self, key, lines):
+        #the profile saved under key, with the attributes of lines, or None
+        if not self.enabled:
+            return None
+        path = os.path.join(self.folder(), key + '.npz')
+        try:
+            saved = np.load(path)
+            profile = xsec_lines.PackedLines(saved['coords'], saved['partStart'], saved['partFeature'],
+                                             lines.fields, lines.atts)
+            saved.close()
+            os.utime(path, None)
+        except (IOError, OSError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return profile
+
+    def save(self, key, profile):
+        if not self.enabled:
+            return
+        folder = self.folder()
+        try:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            #write under a temporary name so a partly written file is never
+            #found by another tool
+            tmp = os.path.join(folder, key + '.tmp.npz')
+            np.savez(tmp, coords=profile.coords, partStart=profile.partStart, partFeature=profile.partFeature)
+            path = os.path.join(folder, key + '.npz')
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp, path)
+            self.evict()
+        except (IOError, OSError):
+            #can't write to the scratch folder; the profile just isn't cached
+            pass
+
+    def evict(self):
+        #delete the least recently used profiles until the cache fits
+        folder = self.folder()
+        files = []
+        for name in os.listdir(folder):
+            if name.endswith('.npz'):
+                path = os.path.join(folder, name)
+                info = os.stat(path)
+                files.append((info.st_mtime, info.st_size, path))
+        files.sort()
+        total = sum(f[1] for f in files)
+        for mtime, size, path in files:
+            if total <= self.maxBytes:
+                break
+            os.remove(path)
+            total -= size
+
+profileCache = ProfileCache(PROFILE_CACHE_BYTES)
+
+def profileSurfaces(surfaces, lines, method='BILINEAR', step=None, cp=None, mode='2D', azimuth=None):
+    '''samples several surfaces, e.g. structure contour grids of stacked
+    horizons, at the same positions along the lines in a PackedLines object.
+    The lines are densified (at step, or the cell size of the first surface)
+    and measured once and every surface is sampled at those vertices.
+    Returns a list of PackedLines with X, Y, Z, M coordinates, one per
+    surface. M is the 2D, 3D, CHORD, or PLANE measure (see PackedLines.measure)
+    from the start of each feature; 3D measures follow the first surface so
+    that every surface has the same stations. Vertices off a surface have a
+    Z of NaN.
+
+    Profiles are taken from profileCache when the same lines have already
+    been sampled from the same surface with the same options. cp, the
+    coordinate priority the lines were oriented with, is part of that key.'''
+    if step is None:
+        step = surfaces[0].cellSize
+    keys = [profileCache.key(lines, surfaces[0], method, step, cp, mode, azimuth)]
+    #3D measures of every other surface come from the first one, so their
+    #profiles change whenever it does
+    measuredOn = keys[0] if mode == '3D' else None
+    keys += [profileCache.key(lines, surface, method, step, cp, mode, azimuth, measuredOn)
+             for surface in surfaces[1:]]
+    profiles = [profileCache.load(key, lines) for key in keys]
+    if None in profiles:
+        lines = lines.densify(step)
+        xy = lines.coords[:, :2]
+        if not mode == '3D':
+            m = lines.measure(mode, azimuth)
+        elif profiles[0] is not None:
+            m = profiles[0].coords[:, 3]
+        for i, surface in enumerate(surfaces):
+            if profiles[i] is None:
+                z = surface.sample(xy[:, 0], xy[:, 1], method)
+                if mode == '3D' and i == 0:
+                    m = lines.withCoords(np.column_stack((xy, z))).measure(mode)
+                profiles[i] = lines.withCoords(np.column_stack((xy, z, m)))
+                profileCache.save(keys[i], profiles[i])
+    return profiles
+
+def profileLines(surface, lines, method='BILINEAR', step=None, cp=None, mode='2D', azimuth=None):
+    '''densifies a PackedLines object at the cell size of the surface (or
+    step), samples the surface at all of the vertices of all of the lines in
+    one call, and returns a PackedLines with X, Y, Z, M coordinates.'''
+    return profileSurfaces([surface], lines, method, step, cp, mode, azimuth)[0]
+
+def _swathStats(z, percentiles):
+    #min, mean, max, and percentiles of each row of z, ignoring NaN.
+    #rows with no valid values give NaN
+    z = np.sort(z, axis=1)
+    count = (~np.isnan(z)).sum(axis=1)
+    has = count > 0
+    rows = np.arange(len(z))
+    last = np.maximum(count - 1, 0)
+    total = np.where(np.isnan(z), 0, z).sum(axis=1)
+    stats = [z[:, 0], total / np.maximum(count, 1), z[rows, last]]
+    for q in percentiles:
+        pos = q / 100.0 * last
+        lo = np.floor(pos).astype(int)
+        hi = np.ceil(pos).astype(int)
+        stats.append(z[rows, lo] + (z[rows, hi] - z[rows, lo]) * (pos - lo))
+    stats = np.column_stack(stats)
+    stats[~has] = np.nan
+    return stats
+
+def swathProfiles(surface, lines, halfWidth, method='BILINEAR', step=None, percentiles=(), mode='2D',
+                  azimuth=None):
+    '''summarizes the surface across a corridor halfWidth either side of the
+    lines in a PackedLines object. At every station along the densified lines
+    the surface is sampled at cell size intervals along the perpendicular,
+    and those samples are reduced to their min, mean, max, and percentiles.
+    Returns a list of (statistic name, PackedLines) with X, Y, Z, M
+    coordinates, where X, Y, and M are those of the center line and Z is the
+    statistic. 3D measures follow the MEAN surface.'''
+    if step is None:
+        step = surface.cellSize
+    lines = lines.densify(step)
+    xy = lines.coords[:, :2]
+    nx, ny = lines.normals()
+
+    #the same perpendicular offsets are used at every station
+    nOff = max(int(math.ceil(halfWidth / surface.cellSize)), 1)
+    offsets = np.linspace(-halfWidth, halfWidth, 2 * nOff + 1)
+    names = ['MIN', 'MEAN', 'MAX'] + ['P%g' % q for q in percentiles]
+    stats = np.empty((len(xy), len(names)))
+
+    #sample the grid of stations x offsets a block of stations at a time
+    #to keep the size of the grid in memory bounded
+    chunk = max(blockPoints // len(offsets), 1)
+    for i in range(0, len(xy), chunk):
+        j = slice(i, i + chunk)
+        sx = xy[j, 0][:, np.newaxis] + nx[j][:, np.newaxis] * offsets
+        sy = xy[j, 1][:, np.newaxis] + ny[j][:, np.newaxis] * offsets
+        z = surface.sample(sx.ravel(), sy.ravel(), method).reshape(sx.shape)
+        stats[j] = _swathStats(z, percentiles)
+
+    if mode == '3D':
+        m = lines.withCoords(np.column_stack((xy, stats[:, 1]))).measure(mode)
+    else:
+        m = lines.measure(mode, azimuth)
+    return [(name, lines.withCoords(np.column_stack((xy, stats[:, k], m))))
+            for k, name in enumerate(names)]
+
+def profileRoutes(dem, lineLayer, keyField, cp=None, method='BILINEAR', mode='2D', azimuth=None):
+    '''in-process replacement for InterpolateShape_3d followed by
+    CreateRoutes_lr. Returns the lines in lineLayer as xsec_routes.Routes in
+    the spatial reference of the DEM, with elevations from dem and measures
+    from the corner named by cp, by mode (see PackedLines.measure); 3D
+    measures are slope distances along the DEM. Vertices off the DEM or over
+    NoData are dropped, splitting the lines into parts on either side of the
+    gap without changing the measures of the vertices that are left. The
+    routes are kept in xsec_routes.registry for later runs in the session.'''
+    surface = openDEM(dem)
+    lines = xsec_lines.PackedLines.fromLayer(lineLayer, [keyField], surface.sr)
+
+    #the same lines profiled from the same surface earlier in the session
+    registry = xsec_routes.registry
+    key = registry.key(lineLayer, lines, (surface.key, keyField, cp, method.upper(), mode, azimuth))
+    routes = registry.get(key)
+    if routes is not None:
+        return routes
+
+    if cp:
+        lines.orient(cp)
+    profiles = profileLines(surface, lines, method, cp=cp, mode=mode, azimuth=azimuth)
+    plane = None
+    if mode == 'PLANE':
+        #fitting the plane along the segments gives the densified lines
+        #the measures were taken on the same plane as the lines themselves
+        plane = xsec_routes.Plane(*lines.planes(azimuth))
+    profiles = profiles.split(~np.isnan(profiles.coords[:, 2]))
+    routes = xsec_routes.Routes(profiles, keyField, surface.sr, plane)
+    registry.put(key, routes)
+    return routes
+
+def addSurfaceZ(pointLayer, dem, zField='Z', method='BILINEAR'):
+    '''in-process replacement for AddSurfaceInformation_3d on points. Adds
+    zField to the table of pointLayer if it isn't there already and calculates
+    the elevation of each point from dem. Points off the DEM or over NoData
+    get a null in zField and the reason, OFF_DEM or NODATA, in STATUS_FIELD.'''
+    surface = openDEM(dem)
+    if len(arcpy.ListFields(pointLayer, zField)) == 0:
+        arcpy.AddField_management(pointLayer, zField, 'DOUBLE')
+    if len(arcpy.ListFields(pointLayer, STATUS_FIELD)) == 0:
+        arcpy.AddField_management(pointLayer, STATUS_FIELD, 'TEXT', '#', '#', 10)
+
+    xy = []
+    rows = arcpy.da.SearchCursor(pointLayer, ['SHAPE@XY'], spatial_reference=surface.sr)
+    for row in rows:
+        xy.append(row[0])
+    del rows
+    xy = np.array(xy, 'f8').reshape(-1, 2)
+    z, codes = surface.sample(xy[:, 0], xy[:, 1], method, True)
+
+    rows = arcpy.da.UpdateCursor(pointLayer, [zField, STATUS_FIELD])
+    for i, row in enumerate(rows):
+        if codes[i] == VALID:
+            rows.updateRow([float(z[i]), None])
+        else:
+            rows.updateRow([None, STATUS[codes[i]]])
+    del rows
+    nMissing = np.count_nonzero(codes)
+    if nMissing > 0:
+        arcpy.AddMessage('    {} of {} points have no elevation; see the {} field'.format(nMissing, len(codes), STATUS_FIELD))
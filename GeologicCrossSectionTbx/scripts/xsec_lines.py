@@ -0,0 +1,410 @@
+'''
+Name: xsec_lines.py
+Description: functions for handling the vertices of line features as NumPy
+    arrays instead of arcpy Point objects. Used by the cross section tools to
+    build profiles in memory without a round trip through scratch feature
+    classes.
+Requirements: ArcGIS 10.1 or later (arcpy.da and the numpy that ships with it)
+Date: 10/18/26
+
+Usage: import xsec_lines
+
+       parts - a list of (n, 2) or wider arrays of vertex coordinates, one
+           array per part of a feature, columns ordered X, Y[, Z][, M]
+       cp - coordinate priority keyword, as returned by getCPValue
+
+A set of lines is handled as a PackedLines object: the vertices of every part
+of every feature in one array, with an array of offsets marking where each
+part starts. Densifying, measuring, and sampling all of the lines is then one
+NumPy operation over that array instead of a loop over the features.
+'''
+import json
+import numpy as np
+import arcpy
+
+
+def asPolyline(parts, hasZ=False, hasM=False):
+    '''creates an arcpy Polyline from a list of coordinate arrays by way of
+    Esri JSON, which avoids building an arcpy Point for every vertex.
+    The geometry has no spatial reference; an insert cursor will assume
+    the spatial reference of the feature class.'''
+    esriJson = {'paths': [np.asarray(part, 'f8').tolist() for part in parts],
+                'hasZ': hasZ, 'hasM': hasM}
+    return arcpy.AsShape(esriJson, True)
+
+def editableFields(layer):
+    #the names of the attribute fields of a layer that can be copied to
+    #another feature class
+    return [f.name for f in arcpy.ListFields(layer)
+            if f.editable and f.type not in ('OID', 'Geometry')]
+
+
+class PackedLines(object):
+    '''the vertices of a set of line features packed into one ragged array.
+
+    coords - (n, k) array of the vertex coordinates of all parts of all features
+    partStart - (p + 1) array of the index in coords of the first vertex of
+        each part, with n as the last entry
+    partFeature - (p) array of the index of the feature each part belongs to,
+        in ascending order
+    fields - names of the attributes in atts
+    atts - list of attribute tuples, one per feature
+    '''
+    def __init__(self, coords, partStart, partFeature, fields, atts):
+        self.coords = coords
+        self.partStart = np.asarray(partStart, int)
+        self.partFeature = np.asarray(partFeature, int)
+        self.fields = list(fields)
+        self.atts = atts
+
+    @classmethod
+    def fromLayer(cls, lineLayer, fields=None, sr=None, hasZ=False):
+        '''reads the XY (or XYZ if hasZ) coordinates and the values of fields
+        of the line features in lineLayer. Features that are not Z-aware get
+        NaN for Z. If sr is provided, the geometries are projected on the fly
+        by the cursor.'''
+        if fields is None:
+            fields = ['OID@']
+        k = 3 if hasZ else 2
+        paths = []
+        partFeature = []
+        atts = []
+        rows = arcpy.da.SearchCursor(lineLayer, list(fields) + ['SHAPE@JSON'], spatial_reference=sr)
+        for row in rows:
+            shape = json.loads(row[-1])
+            for path in shape.get('paths', []):
+                if len(path) > 1:
+                    path = np.array(path, 'f8')
+                    if hasZ and not shape.get('hasZ', False):
+                        path = np.column_stack((path[:, :2], np.nan * np.ones(len(path))))
+                    paths.append(path[:, :k])
+                    partFeature.append(len(atts))
+            atts.append(tuple(row[:-1]))
+        del rows
+
+        counts = [len(path) for path in paths]
+        partStart = np.concatenate(([0], np.cumsum(counts))).astype(int)
+        if paths:
+            coords = np.vstack(paths)
+        else:
+            coords = np.zeros((0, k))
+        return cls(coords, partStart, partFeature, fields, atts)
+
+    @property
+    def nFeatures(self):
+        return len(self.atts)
+
+    @property
+    def nParts(self):
+        return len(self.partFeature)
+
+    def withCoords(self, coords):
+        #a copy with the same parts and features but new coordinate columns
+        return PackedLines(coords, self.partStart, self.partFeature, self.fields, self.atts)
+
+    def vertexPart(self):
+        return np.repeat(np.arange(self.nParts), np.diff(self.partStart))
+
+    def vertexFeature(self):
+        return self.partFeature[self.vertexPart()]
+
+    def featureParts(self):
+        #the index of the first part and one past the last part of each feature
+        features = np.arange(self.nFeatures)
+        return (np.searchsorted(self.partFeature, features, 'left'),
+                np.searchsorted(self.partFeature, features, 'right'))
+
+    def segments(self):
+        #the index of the first vertex of every segment that lies within a part
+        vp = self.vertexPart()
+        return np.flatnonzero(vp[:-1] == vp[1:])
+
+    def parts(self, feature):
+        #list of coordinate arrays of the parts of one feature
+        first, last = np.searchsorted(self.partFeature, [feature, feature + 1])
+        return [self.coords[self.partStart[p]:self.partStart[p + 1]] for p in range(first, last)]
+
+    def densify(self, step):
+        '''a copy with vertices added so that no segment is longer than
+        step. The original vertices are kept and every coordinate column is
+        interpolated.'''
+        if step <= 0 or len(self.coords) == 0:
+            return self
+        seg = self.segments()
+        d = self.coords[seg + 1] - self.coords[seg]
+        nSub = np.maximum(np.ceil(np.hypot(d[:, 0], d[:, 1]) / step), 1).astype(int)
+
+        #the vertices along each segment, up to but not including its end
+        rep = np.repeat(np.arange(len(seg)), nSub)
+        starts = np.cumsum(nSub) - nSub
+        frac = (np.arange(nSub.sum()) - starts[rep]) / nSub[rep].astype(float)
+        segPts = self.coords[seg[rep]] + d[rep] * frac[:, np.newaxis]
+
+        #each part gets its segment vertices and then its last vertex
+        counts = np.bincount(self.vertexPart()[seg], nSub, self.nParts).astype(int) + 1
+        partStart = np.concatenate(([0], np.cumsum(counts)))
+        lastPos = partStart[1:] - 1
+        coords = np.empty((partStart[-1], self.coords.shape[1]))
+        isSeg = np.ones(len(coords), bool)
+        isSeg[lastPos] = False
+        coords[isSeg] = segPts
+        coords[lastPos] = self.coords[self.partStart[1:] - 1]
+        return PackedLines(coords, partStart, self.partFeature, self.fields, self.atts)
+
+    def densifiedCount(self, step):
+        #the number of vertices densify(step) would return, without building them
+        if step <= 0 or len(self.coords) == 0:
+            return len(self.coords)
+        seg = self.segments()
+        d = self.coords[seg + 1] - self.coords[seg]
+        nSub = np.maximum(np.ceil(np.hypot(d[:, 0], d[:, 1]) / step), 1).astype(int)
+        return int(nSub.sum()) + self.nParts
+
+    def normals(self):
+        '''unit vectors perpendicular to the lines at every vertex, pointing
+        to the left of the direction of the line. At interior vertices the
+        directions of the two segments are averaged.'''
+        t = np.zeros((len(self.coords), 2))
+        seg = self.segments()
+        d = self.coords[seg + 1, :2] - self.coords[seg, :2]
+        length = np.hypot(d[:, 0], d[:, 1])
+        u = d / np.where(length > 0, length, 1)[:, np.newaxis]
+        t[seg] += u
+        t[seg + 1] += u
+        length = np.hypot(t[:, 0], t[:, 1])
+        t /= np.where(length > 0, length, 1)[:, np.newaxis]
+        return -t[:, 1], t[:, 0]
+
+    def withAttribute(self, field, value):
+        #a copy with one more attribute, the same value for every feature
+        return PackedLines(self.coords, self.partStart, self.partFeature,
+                           self.fields + [field], [a + (value,) for a in self.atts])
+
+    def planes(self, azimuth=None):
+        '''the vertical plane of each feature for PLANE measures, as (f, 2)
+        arrays of origins and unit directions. The plane runs at azimuth,
+        in degrees clockwise from north, or if azimuth is None along the
+        best-fit (principal axis) line through the segments of the feature.
+        The origin is the first vertex and the direction points toward the
+        end of the feature, so measures still start from that end.'''
+        nF = self.nFeatures
+        origin = np.zeros((nF, 2))
+        direction = np.zeros((nF, 2))
+        if len(self.coords) == 0:
+            return origin, direction
+        firstPart, lastPart = self.featureParts()
+        has = lastPart > firstPart
+        xy = self.coords[:, :2]
+        origin[has] = xy[self.partStart[firstPart[has]]]
+        toEnd = xy[self.partStart[lastPart[has]] - 1] - origin[has]
+
+        if azimuth is None:
+            #orientation of the principal axis from the covariance of each
+            #feature taken along its segments, weighted by their length, so
+            #that densifying a line does not change its plane
+            seg = self.segments()
+            sf = self.vertexFeature()[seg]
+            a = xy[seg]
+            d = xy[seg + 1] - a
+            mid = a + 0.5 * d
+            length = np.hypot(d[:, 0], d[:, 1])
+            total = np.maximum(np.bincount(sf, length, nF), 1e-300)
+            mean = np.column_stack([np.bincount(sf, length * mid[:, k], nF) for k in (0, 1)]) / total[:, np.newaxis]
+            #second moment of each segment about the mean of its feature
+            c = mid - mean[sf]
+            moment = lambda i, j: np.bincount(sf, length * (c[:, i] * c[:, j] + d[:, i] * d[:, j] / 12.0), nF)
+            cxx, cyy, cxy = moment(0, 0), moment(1, 1), moment(0, 1)
+            theta = 0.5 * np.arctan2(2 * cxy, cxx - cyy)
+            direction = np.column_stack((np.cos(theta), np.sin(theta)))
+        else:
+            theta = np.radians(float(azimuth))
+            direction[:] = (np.sin(theta), np.cos(theta))
+        flip = np.zeros(nF, bool)
+        flip[has] = (toEnd * direction[has]).sum(axis=1) < 0
+        direction[flip] *= -1
+        return origin, direction
+
+    def measure(self, mode='2D', azimuth=None):
+        '''the measure of every vertex from the start of its feature, by mode:
+        '2D' - cumulative distance along X and Y
+        '3D' - cumulative distance along X, Y, and Z, i.e. slope distance.
+            Segments with a NaN Z count their 2D length
+        'CHORD' - distance along the straight line from the first to the
+            last vertex of the feature, of the vertex projected onto it
+        'PLANE' - distance along the vertical plane of the feature (see
+            planes), at azimuth or best-fit, of the vertex projected onto it
+        Gaps between the parts of a feature are not counted by 2D or 3D.'''
+        n = len(self.coords)
+        m = np.zeros(n)
+        if n == 0:
+            return m
+        firstPart, lastPart = self.featureParts()
+        vf = self.vertexFeature()
+        first = self.partStart[firstPart[vf]]
+        if mode == 'PLANE':
+            origin, direction = self.planes(azimuth)
+            return ((self.coords[:, :2] - origin[vf]) * direction[vf]).sum(axis=1)
+        if mode == 'CHORD':
+            last = self.partStart[lastPart[vf]] - 1
+            xy = self.coords[:, :2]
+            chord = xy[last] - xy[first]
+            length = np.hypot(chord[:, 0], chord[:, 1])
+            u = chord / np.where(length > 0, length, 1.0)[:, np.newaxis]
+            return ((xy - xy[first]) * u).sum(axis=1)
+        if mode not in ('2D', '3D'):
+            raise ValueError('unknown measure mode: ' + str(mode))
+
+        seg = self.segments()
+        d = self.coords[seg + 1, :2] - self.coords[seg, :2]
+        d2 = (d * d).sum(axis=1)
+        if mode == '3D':
+            dz = self.coords[seg + 1, 2] - self.coords[seg, 2]
+            d2 += np.where(np.isnan(dz), 0.0, dz) ** 2
+        step = np.zeros(n)
+        step[seg + 1] = np.sqrt(d2)
+        np.cumsum(step, out=m)
+
+        #restart the count at the first vertex of each feature
+        return m - m[first]
+
+    def orient(self, cp):
+        '''reverses, in place, the features whose last vertex is closer than
+        their first vertex to the corner of their extent named by cp, so that
+        measures will accumulate from that corner as they do in CreateRoutes.
+        Returns a boolean array of the features that were reversed.'''
+        firstPart, endPart = self.featureParts()
+        flip = np.zeros(self.nFeatures, bool)
+        has = endPart > firstPart
+        if not has.any():
+            return flip
+        vStart = self.partStart[firstPart[has]]
+        vEnd = self.partStart[endPart[has]]
+        x = self.coords[:, 0]
+        y = self.coords[:, 1]
+        cx = np.minimum.reduceat(x, vStart) if 'LEFT' in cp else np.maximum.reduceat(x, vStart)
+        cy = np.maximum.reduceat(y, vStart) if 'UPPER' in cp else np.minimum.reduceat(y, vStart)
+        dFirst = np.hypot(x[vStart] - cx, y[vStart] - cy)
+        dLast = np.hypot(x[vEnd - 1] - cx, y[vEnd - 1] - cy)
+        flip[has] = dLast < dFirst
+        if not flip.any():
+            return flip
+
+        #reversing the whole block of vertices of a feature reverses both
+        #the order of its parts and the order of the vertices in each part
+        first = np.zeros(self.nFeatures, int)
+        last = np.zeros(self.nFeatures, int)
+        first[has] = vStart
+        last[has] = vEnd - 1
+        vf = self.vertexFeature()
+        idx = np.arange(len(self.coords))
+        fv = flip[vf]
+        idx[fv] = first[vf[fv]] + last[vf[fv]] - idx[fv]
+
+        pf = self.partFeature
+        pIdx = np.arange(self.nParts)
+        fp = flip[pf]
+        pIdx[fp] = firstPart[pf[fp]] + endPart[pf[fp]] - 1 - pIdx[fp]
+        counts = np.diff(self.partStart)[pIdx]
+
+        self.coords = self.coords[idx]
+        self.partStart = np.concatenate(([0], np.cumsum(counts))).astype(int)
+        return flip
+
+    def simplifyProfile(self, tolerance, ve):
+        '''a copy of XYZM lines with vertices removed by Douglas-Peucker in
+        cross-section space, where X is M and Y is Z times the vertical
+        exaggeration. tolerance is in elevation units and is scaled by ve
+        along with Z, so the same tolerance gives the same result on the
+        page at any exaggeration.'''
+        ve = float(ve)
+        keep = douglasPeucker(self.coords[:, 3], self.coords[:, 2] * ve,
+                              self.partStart, float(tolerance) * ve)
+        return self.select(keep)
+
+    def select(self, keep):
+        '''a copy with only the vertices where keep is True. Parts left with
+        fewer than two vertices are dropped; features are kept even if they
+        end up with no parts.'''
+        vp = self.vertexPart()
+        counts = np.bincount(vp[keep], minlength=self.nParts)
+        good = counts > 1
+        keep = keep & good[vp]
+        partStart = np.concatenate(([0], np.cumsum(counts[good]))).astype(int)
+        return PackedLines(self.coords[keep], partStart, self.partFeature[good], self.fields, self.atts)
+
+    def split(self, valid):
+        '''a copy with only the vertices where valid is True, where each run
+        of valid vertices becomes its own part, so that a line crossing a gap
+        (e.g. NoData in a DEM) ends up multipart instead of being joined
+        across it. Parts shorter than two vertices are dropped as in select.'''
+        valid = np.asarray(valid, bool)
+        vp = self.vertexPart()
+        newPart = valid.copy()
+        newPart[1:] &= ~valid[:-1] | (vp[1:] != vp[:-1])
+        nValid = valid.sum()
+        partStart = np.concatenate((np.flatnonzero(newPart[valid]), [nValid]))
+        lines = PackedLines(self.coords[valid], partStart, self.partFeature[vp[newPart]], self.fields, self.atts)
+        return lines.select(np.ones(nValid, bool))
+
+
+def douglasPeucker(x, y, partStart, tolerance):
+    '''Douglas-Peucker simplification of every part in a packed array at once.
+    Returns a boolean array of the vertices to keep. Instead of recursing
+    into one part at a time, each pass finds the farthest vertex of every
+    open interval of every part and splits all of the intervals that are
+    out of tolerance together.'''
+    partStart = np.asarray(partStart, int)
+    keep = np.zeros(len(x), bool)
+    keep[partStart[:-1]] = True
+    keep[partStart[1:] - 1] = True
+    s = partStart[:-1]
+    e = partStart[1:] - 1
+    while True:
+        open_ = e - s > 1
+        s = s[open_]
+        e = e[open_]
+        if len(s) == 0:
+            return keep
+
+        #every interior vertex of every interval
+        counts = e - s - 1
+        group = np.repeat(np.arange(len(s)), counts)
+        offsets = np.cumsum(counts) - counts
+        idx = np.arange(counts.sum()) - offsets[group] + s[group] + 1
+
+        #perpendicular distance to the chord, or to the start of a closed interval
+        x0 = x[s][group]
+        y0 = y[s][group]
+        dx = (x[e] - x[s])[group]
+        dy = (y[e] - y[s])[group]
+        chord = np.hypot(dx, dy)
+        px = x[idx] - x0
+        py = y[idx] - y0
+        closed = chord == 0
+        d = np.abs(dy * px - dx * py) / np.where(closed, 1, chord)
+        d[closed] = np.hypot(px[closed], py[closed])
+
+        #the first vertex at the maximum distance of each interval
+        dMax = np.maximum.reduceat(d, offsets)
+        far = np.flatnonzero(d == dMax[group])
+        far = far[np.unique(group[far], return_index=True)[1]]
+        split = dMax[group[far]] > tolerance
+        k = idx[far][split]
+        keep[k] = True
+        g = group[far][split]
+        s, e = np.concatenate((s[g], k)), np.concatenate((k, e[g]))
+
+def insertLines(fc, lines, fields=None, hasZ=False, hasM=False):
+    '''writes the features of a PackedLines object to the existing feature
+    class fc, with the values of fields (by default all of lines.fields).
+    Features without any parts are skipped.'''
+    if fields is None:
+        fields = lines.fields
+    cols = [lines.fields.index(f) for f in fields]
+    rows = arcpy.da.InsertCursor(fc, list(fields) + ['SHAPE@'])
+    for f in range(lines.nFeatures):
+        parts = lines.parts(f)
+        if parts:
+            atts = [lines.atts[f][c] for c in cols]
+            rows.insertRow(atts + [asPolyline(parts, hasZ, hasM)])
+    del rows
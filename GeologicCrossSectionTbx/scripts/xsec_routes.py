@@ -0,0 +1,740 @@
+'''
+Name: xsec_routes.py
+Description: linear referencing for the cross section tools done with NumPy
+    in memory instead of with the Linear Referencing toolbox. Section lines
+    are measured into routes the way CreateRoutes_lr does with the LENGTH
+    option and a coordinate priority, without writing a scratch feature class.
+Requirements: ArcGIS 10.1 or later (arcpy.da and the numpy that ships with it)
+Date: 10/18/26
+
+Usage: import xsec_routes
+
+       keyField - the field that identifies each route, usually ORIG_FID
+       cp - coordinate priority keyword, as returned by getCPValue
+       mode - '2D' measures along X and Y, '3D' along X, Y, and Z (slope
+           distance), 'CHORD' along the straight line between the ends,
+           'PLANE' along a vertical plane at azimuth or best-fit
+       azimuth - direction of the plane in PLANE mode, degrees clockwise
+           from north; None fits the plane to each line
+       radius - search distance, in map units, around the routes
+
+Points are located on routes with a SegmentIndex, a uniform grid over the
+bounding boxes of the route segments, built once per set of routes. Every
+point is checked against only the few segments registered in its grid cell,
+and all of the points are located in a handful of NumPy operations instead
+of a scan of every segment for every point.
+
+Routes measured in PLANE mode are not located on at all. Points are
+projected orthogonally onto the vertical plane of each route with one matrix
+product, so measures and angles don't jump at the bends of a kinked line and
+points near a bend can't fall on the wrong leg.
+
+Polygons are overlaid on routes by cutting each route part where it crosses
+the polygon edges and keeping the pieces whose midpoints are inside. Only
+polygons whose extent overlaps a route, and only the route segments that
+overlap the extent of the polygon, are compared.
+'''
+import os
+import json
+import hashlib
+import collections
+import numpy as np
+import arcpy
+import xsec_lines
+
+#meters per unit of the unit names in Linear unit parameter strings
+LINEAR_UNITS = {'meters': 1.0, 'kilometers': 1000.0, 'centimeters': 0.01,
+                'millimeters': 0.001, 'decimeters': 0.1, 'feet': 0.3048,
+                'yards': 0.9144, 'inches': 0.0254, 'miles': 1609.344,
+                'nauticalmiles': 1852.0}
+
+#the grid of a SegmentIndex is never finer than the extent of the routes
+#divided by this number of cells
+MAX_GRID = 2048
+
+#segment pairs compared at once when intersecting routes with polygon
+#edges, to bound the size of the temporary arrays
+PAIR_BLOCK = 2 ** 20
+
+#sets of measured routes kept in the session route registry
+MAX_ROUTE_SETS = 32
+
+#one row per point located on a route:
+#point - index of the point in the arrays that were located
+#feature - index of the route feature in routes.lines
+#m - measure of the closest location on the route
+#offset - signed distance from the route, positive to the left in the
+#    direction of increasing measures
+#angle - direction of the route at that location, in degrees
+#    counter-clockwise from east
+#distance - unsigned distance from the route
+Located = collections.namedtuple('Located', 'point feature m offset angle distance')
+
+#the vertical planes of routes measured in PLANE mode, one row per feature:
+#origin - (f, 2) array of the point on each plane where the measure is 0
+#direction - (f, 2) array of unit vectors along each plane
+Plane = collections.namedtuple('Plane', 'origin direction')
+
+
+def searchRadius(buff, sr=None):
+    '''the value of a Linear unit parameter, e.g. '500 Meters', in the units
+    of sr. A bare number or one in Unknown units is taken as map units.'''
+    values = buff.split()
+    if not values or values[0] == '#':
+        return 0.0
+    radius = float(values[0])
+    if len(values) > 1 and values[1].lower() in LINEAR_UNITS and sr is not None:
+        try:
+            radius = radius * LINEAR_UNITS[values[1].lower()] / sr.metersPerUnit
+        except (AttributeError, TypeError, ZeroDivisionError):
+            #geographic or unknown spatial references have no meters per unit
+            pass
+    return radius
+
+
+class Routes(object):
+    '''measured lines, one route per feature.
+
+    lines - PackedLines with X, Y[, Z], M coordinates
+    keyField - the attribute of lines that identifies each route
+    sr - spatial reference of the coordinates
+    plane - Plane of each feature if the routes were measured in PLANE mode
+    '''
+    def __init__(self, lines, keyField, sr=None, plane=None):
+        self.lines = lines
+        self.keyField = keyField
+        self.sr = sr
+        self.plane = plane
+
+    @classmethod
+    def measureLines(cls, lines, keyField, cp=None, mode='2D', sr=None, azimuth=None):
+        '''routes from a PackedLines object. Features are first reversed as
+        needed so that measures start at the end closest to the corner of
+        their extent named by cp, as with CreateRoutes. M is the 2D, 3D,
+        CHORD, or PLANE measure (see PackedLines.measure) from that end.'''
+        lines = lines.withCoords(lines.coords.copy())
+        if cp:
+            lines.orient(cp)
+        m = lines.measure(mode, azimuth)
+        plane = Plane(*lines.planes(azimuth)) if mode == 'PLANE' else None
+        return cls(lines.withCoords(np.column_stack((lines.coords, m))), keyField, sr, plane)
+
+    @property
+    def hasZ(self):
+        return self.lines.coords.shape[1] == 4
+
+    @property
+    def m(self):
+        return self.lines.coords[:, -1]
+
+    @property
+    def ids(self):
+        #the key value of every route, in feature order
+        k = self.lines.fields.index(self.keyField)
+        return [a[k] for a in self.lines.atts]
+
+    def index(self, radius):
+        #the segment index of these routes for a search radius, built the
+        #first time it is asked for
+        if getattr(self, '_index', None) is None or self._index.radius != radius:
+            self._index = SegmentIndex(self, radius)
+        return self._index
+
+    def locate(self, x, y, radius, allRoutes=False):
+        '''locates arrays of x and y on the routes, within radius. Returns a
+        Located tuple of arrays with one row for each point that is within
+        radius of a route: at the closest location on any route, or with
+        allRoutes, at the closest location on each route within radius.
+        Where two locations are equally close the one with the lower measure
+        is used, so the result never depends on the order of the segments.
+        Routes measured in PLANE mode project the points onto their planes
+        instead; see project.'''
+        if self.plane is not None:
+            return self.project(x, y, radius, allRoutes)
+        return self.index(radius).nearest(x, y, allRoutes)
+
+    def project(self, x, y, radius, allRoutes=False):
+        '''locates points by projecting them orthogonally onto the vertical
+        plane of each route. Offsets are measured from the plane, not the
+        line, and the angle is that of the plane. A point is on a route if
+        it is within radius of the plane and its measure is within radius of
+        the measures of the route.'''
+        x = np.asarray(x, 'f8')
+        y = np.asarray(y, 'f8')
+        origin, direction = self.plane
+        nF = len(origin)
+        vf = self.lines.vertexFeature()
+        m = self.m
+        mMin = np.repeat(np.inf, nF)
+        mMax = np.repeat(-np.inf, nF)
+        if len(m):
+            order = np.lexsort((m, vf))
+            starts = np.searchsorted(vf[order], np.arange(nF))
+            ends = np.searchsorted(vf[order], np.arange(nF), 'right')
+            has = ends > starts
+            mMin[has] = m[order][starts[has]]
+            mMax[has] = m[order][ends[has] - 1]
+
+        #rows of the along and the left unit vectors of every plane, so one
+        #product gives the measure and the offset of every point on every plane
+        axes = np.vstack((direction, np.column_stack((-direction[:, 1], direction[:, 0]))))
+        shift = (np.vstack((origin, origin)) * axes).sum(axis=1)
+        angle = np.degrees(np.arctan2(direction[:, 1], direction[:, 0]))
+        block = max(1, PAIR_BLOCK // max(nF, 1))
+        found = []
+        for i in range(0, len(x), block):
+            xy = np.column_stack((x[i:i + block], y[i:i + block]))
+            projected = xy.dot(axes.T) - shift
+            along = projected[:, :nF]
+            left = projected[:, nF:]
+            near = (np.abs(left) <= radius) & (along >= mMin - radius) & (along <= mMax + radius)
+            point, feature = np.nonzero(near)
+            found.append(Located(point + i, feature, along[point, feature], left[point, feature],
+                                 angle[feature], np.abs(left[point, feature])))
+        if not found:
+            return Located(*[np.zeros(0, int)] * 2 + [np.zeros(0)] * 4)
+        located = Located(*[np.concatenate(a) for a in zip(*found)])
+        return closest(located, allRoutes)
+
+    def shift(self, offsets):
+        '''a copy of the routes with offsets[f] added to every measure of
+        feature f, e.g. to re-zero a section at a tie point. NaN offsets
+        leave the feature as it is.'''
+        offsets = np.nan_to_num(np.asarray(offsets, 'f8'))
+        coords = self.lines.coords.copy()
+        coords[:, -1] += offsets[self.lines.vertexFeature()]
+        plane = self.plane
+        if plane is not None:
+            #move the origin of the plane back along it by the same amount
+            plane = Plane(plane.origin - offsets[:, np.newaxis] * plane.direction, plane.direction)
+        return Routes(self.lines.withCoords(coords), self.keyField, self.sr, plane)
+
+    def monotonic(self):
+        '''True for each feature whose measures never decrease along any of
+        its parts, which slice and overlay depend on. 2D and 3D measures
+        always do; CHORD and PLANE measures go back where a line doubles
+        back along its chord or plane.'''
+        if getattr(self, '_monotonic', None) is None:
+            m = self.m
+            down = np.zeros(len(m), bool)
+            down[1:] = m[1:] < m[:-1]
+            starts = self.lines.partStart[:-1]
+            down[starts[starts < len(m)]] = False
+            self._monotonic = np.bincount(self.lines.vertexFeature()[down],
+                                          minlength=self.lines.nFeatures) == 0
+        return self._monotonic
+
+    def checkMonotonic(self, features):
+        #AddError and raise SystemError if any of features has measures that
+        #decrease along the line
+        bad = np.unique(np.asarray(features, int)[~self.monotonic()[features]])
+        if len(bad):
+            ids = self.ids
+            arcpy.AddError('The measures of route {} decrease along the line, so intervals cannot be cut '
+                           'from it. Use 2D or 3D measures for lines that double back.'.format(
+                               ', '.join(str(ids[f]) for f in bad)))
+            raise SystemError
+
+    def intersect(self, lines):
+        '''the measures at which the routes cross the segments of another
+        PackedLines object, e.g. a tie line. Returns arrays of feature and
+        measure, sorted by feature and then measure.'''
+        coords = self.lines.coords
+        seg = self.lines.segments()
+        other = lines.segments()
+        if len(seg) == 0 or len(other) == 0:
+            return np.zeros(0, int), np.zeros(0)
+        s, t = crossings(coords[seg, :2], coords[seg + 1, :2],
+                         lines.coords[other, :2], lines.coords[other + 1, :2])
+        seg = seg[s]
+        m = coords[seg, -1] + t * (coords[seg + 1, -1] - coords[seg, -1])
+        feature = self.lines.vertexFeature()[seg]
+        order = np.lexsort((m, feature))
+        return feature[order], m[order]
+
+    def slice(self, feature, fromM, toM):
+        '''the parts of the route feature that lie between the measures fromM
+        and toM, as a list of coordinate arrays in order of increasing
+        measure. The cut points are interpolated in every coordinate column,
+        so they carry Z and M. Parts of the route that overlap the interval
+        by zero length are left out. The measures of the feature must not
+        decrease along it; see monotonic.'''
+        self.checkMonotonic([feature])
+        lo, hi = min(fromM, toM), max(fromM, toM)
+        coords = self.lines.coords
+        parts = []
+        first, last = np.searchsorted(self.lines.partFeature, [feature, feature + 1])
+        for p in range(first, last):
+            part = coords[self.lines.partStart[p]:self.lines.partStart[p + 1]]
+            m = part[:, -1]
+            a, b = max(lo, m[0]), min(hi, m[-1])
+            if not b > a:
+                continue
+            #the vertices strictly between the cuts, plus the cut points
+            i = np.searchsorted(m, a, 'right')
+            j = np.searchsorted(m, b, 'left')
+            cuts = np.array([np.interp([a, b], m, column) for column in part.T]).T
+            parts.append(np.vstack((cuts[:1], part[i:j], cuts[1:])))
+        return parts
+
+    def overlay(self, a, b):
+        '''the intervals of the routes that lie inside a polygon whose ring
+        edges run from the points in a to the points in b, (e, 2) arrays.
+        Each part near the polygon is cut where it crosses an edge and the
+        pieces whose midpoints fall inside the polygon are kept, with
+        touching pieces merged. Returns arrays of feature, fromM, and toM.
+        The measures of the routes near the polygon must not decrease along
+        them; see monotonic.'''
+        lines = self.lines
+        coords = lines.coords
+        m = coords[:, -1]
+        if not hasattr(self, '_segments'):
+            self._segments = lines.segments()
+        seg = self._segments
+
+        #only the segments that overlap the box of the polygon
+        lo = np.minimum(a, b).min(axis=0)
+        hi = np.maximum(a, b).max(axis=0)
+        p0 = coords[seg, :2]
+        p1 = coords[seg + 1, :2]
+        near = (np.maximum(p0, p1) >= lo).all(axis=1) & (np.minimum(p0, p1) <= hi).all(axis=1)
+        seg = seg[near]
+        if len(seg) == 0:
+            return np.zeros(0, int), np.zeros(0), np.zeros(0)
+        self.checkMonotonic(lines.vertexFeature()[seg])
+        s, t = crossings(coords[seg, :2], coords[seg + 1, :2], a, b)
+        cutM = m[seg[s]] + t * (m[seg[s] + 1] - m[seg[s]])
+        cutPart = lines.vertexPart()[seg[s]]
+
+        features, fromM, toM = [], [], []
+        for p in np.unique(lines.vertexPart()[seg]):
+            start, end = lines.partStart[p], lines.partStart[p + 1]
+            pm = m[start:end]
+            cuts = np.unique(np.concatenate(([pm[0], pm[-1]], cutM[cutPart == p])))
+            mid = (cuts[:-1] + cuts[1:]) / 2.0
+            x = np.interp(mid, pm, coords[start:end, 0])
+            y = np.interp(mid, pm, coords[start:end, 1])
+            inside = insidePolygon(x, y, a, b) & (cuts[1:] > cuts[:-1])
+
+            #merge runs of pieces that are inside
+            first = inside.copy()
+            first[1:] &= ~inside[:-1]
+            last = inside.copy()
+            last[:-1] &= ~inside[1:]
+            fromM.append(cuts[:-1][first])
+            toM.append(cuts[1:][last])
+            features.append(np.repeat(lines.partFeature[p], first.sum()))
+        return np.concatenate(features), np.concatenate(fromM), np.concatenate(toM)
+
+    def write(self, fc, keyField=None):
+        '''writes the routes to a new M-aware (and Z-aware if the routes
+        have Z) feature class, e.g. in the in_memory workspace, for tools
+        that still need a route feature class. The route keys are written to
+        keyField, by default the key field of the routes; a token key such
+        as OID@ needs a real field name.'''
+        if keyField is None:
+            keyField = self.keyField
+        outPath, outName = os.path.split(fc)
+        hasZ = 'ENABLED' if self.hasZ else 'DISABLED'
+        arcpy.CreateFeatureclass_management(outPath, outName, 'POLYLINE', '#', 'ENABLED', hasZ, self.sr)
+        arcpy.AddField_management(fc, keyField, 'LONG')
+        lines = xsec_lines.PackedLines(self.lines.coords, self.lines.partStart, self.lines.partFeature,
+                                       [keyField], [(key,) for key in self.ids])
+        xsec_lines.insertLines(fc, lines, [keyField], self.hasZ, True)
+        return fc
+
+
+class RouteRegistry(object):
+    '''measured routes kept for the rest of the session, so that every tool
+    run on the same section lines with the same options gets the same Routes
+    object, with its segment index, instead of measuring the lines again.
+    Routes are found by the dataset and object ids of the lines, a hash of
+    their vertices, and the options they were measured with, so an edit to
+    a line makes new routes. Routes are keyed by OID@, so nothing is added
+    to the table of the lines. The least recently used sets are dropped once
+    there are more than maxSets.
+
+    Routes are shared, so callers must not change their coordinates in
+    place; shift returns a copy.'''
+    def __init__(self, maxSets):
+        self.maxSets = maxSets
+        self.routes = collections.OrderedDict()
+        self.hits = 0
+
+    def key(self, lineLayer, lines, options):
+        h = hashlib.md5()
+        for a in (lines.coords, lines.partStart, lines.partFeature):
+            h.update(np.ascontiguousarray(a, 'f8').tostring())
+        source = arcpy.Describe(lineLayer).catalogPath
+        h.update(repr((source, lines.atts, options)).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        routes = self.routes.pop(key, None)
+        if routes is not None:
+            self.routes[key] = routes
+            self.hits += 1
+        return routes
+
+    def put(self, key, routes):
+        self.routes[key] = routes
+        while len(self.routes) > self.maxSets:
+            self.routes.popitem(last=False)
+
+    def clear(self):
+        self.routes.clear()
+
+registry = RouteRegistry(MAX_ROUTE_SETS)
+
+
+def sectionRoutes(lineLayer, cp=None, mode='2D', azimuth=None, sr=None):
+    '''the routes of the line features in lineLayer, keyed by OID@, from the
+    session registry, or measured with Routes.measureLines and registered
+    the first time they are asked for. If sr is not provided the routes are
+    in the spatial reference of lineLayer.'''
+    if sr is None:
+        sr = arcpy.Describe(lineLayer).spatialReference
+    lines = xsec_lines.PackedLines.fromLayer(lineLayer, ['OID@'], sr, mode == '3D')
+    key = registry.key(lineLayer, lines, (sr.exportToString(), cp, mode, azimuth))
+    routes = registry.get(key)
+    if routes is None:
+        routes = Routes.measureLines(lines, 'OID@', cp, mode, sr, azimuth)
+        registry.put(key, routes)
+    return routes
+
+
+class SegmentIndex(object):
+    '''uniform grid over the bounding boxes of the segments of a set of
+    routes, each box grown by the search radius. A point only needs to be
+    compared with the segments registered in the one grid cell it falls in.'''
+    def __init__(self, routes, radius):
+        self.radius = float(radius)
+        lines = routes.lines
+        seg = lines.segments()
+        coords = lines.coords
+        self.a = coords[seg, :2]
+        self.b = coords[seg + 1, :2]
+        self.m0 = coords[seg, -1]
+        self.m1 = coords[seg + 1, -1]
+        self.feature = lines.vertexFeature()[seg]
+        self.cells = np.zeros(0, int)
+        self.cellStart = np.zeros(1, int)
+        self.segs = np.zeros(0, int)
+        if len(seg) == 0:
+            return
+
+        lo = np.minimum(self.a, self.b) - self.radius
+        hi = np.maximum(self.a, self.b) + self.radius
+        self.origin = lo.min(axis=0)
+        extent = (hi.max(axis=0) - self.origin).max()
+        length = np.hypot(*(self.b - self.a).T)
+        self.cellSize = max(length.mean(), self.radius, extent / MAX_GRID, 1e-9)
+
+        #register every segment in every cell its grown box covers
+        i0 = np.floor((lo - self.origin) / self.cellSize).astype(int)
+        i1 = np.floor((hi - self.origin) / self.cellSize).astype(int)
+        self.nCols = int(i1[:, 0].max()) + 1
+        self.nRows = int(i1[:, 1].max()) + 1
+        width = i1[:, 0] - i0[:, 0] + 1
+        n = width * (i1[:, 1] - i0[:, 1] + 1)
+        rep = np.repeat(np.arange(len(seg)), n)
+        k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        col = i0[rep, 0] + k % width[rep]
+        row = i0[rep, 1] + k // width[rep]
+        cellId = row * self.nCols + col
+
+        order = np.argsort(cellId, kind='mergesort')
+        cellId = cellId[order]
+        self.segs = rep[order]
+        first = np.concatenate(([0], np.flatnonzero(np.diff(cellId)) + 1))
+        self.cells = cellId[first]
+        self.cellStart = np.concatenate((first, [len(cellId)]))
+
+    def candidates(self, x, y):
+        #every (point, segment) pair where the segment is registered in the
+        #grid cell of the point
+        x = np.asarray(x, 'f8')
+        y = np.asarray(y, 'f8')
+        if len(self.cells) == 0 or len(x) == 0:
+            return np.zeros(0, int), np.zeros(0, int)
+        col = np.floor((x - self.origin[0]) / self.cellSize).astype(int)
+        row = np.floor((y - self.origin[1]) / self.cellSize).astype(int)
+        inGrid = (col >= 0) & (col < self.nCols) & (row >= 0) & (row < self.nRows)
+        cellId = row * self.nCols + col
+        pos = np.minimum(np.searchsorted(self.cells, cellId), len(self.cells) - 1)
+        found = np.flatnonzero(inGrid & (self.cells[pos] == cellId))
+
+        start = self.cellStart[pos[found]]
+        count = self.cellStart[pos[found] + 1] - start
+        point = np.repeat(found, count)
+        k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        return point, self.segs[np.repeat(start, count) + k]
+
+    def measurePairs(self, x, y, point, seg):
+        #project each point onto its candidate segment
+        a = self.a[seg]
+        d = self.b[seg] - a
+        px = np.asarray(x, 'f8')[point] - a[:, 0]
+        py = np.asarray(y, 'f8')[point] - a[:, 1]
+        dd = (d * d).sum(axis=1)
+        t = np.clip((px * d[:, 0] + py * d[:, 1]) / np.where(dd > 0, dd, 1), 0, 1)
+        ex = px - t * d[:, 0]
+        ey = py - t * d[:, 1]
+        distance = np.hypot(ex, ey)
+        side = np.sign(d[:, 0] * py - d[:, 1] * px)
+        m = self.m0[seg] + t * (self.m1[seg] - self.m0[seg])
+        angle = np.degrees(np.arctan2(d[:, 1], d[:, 0]))
+        return Located(point, self.feature[seg], m, np.where(side < 0, -distance, distance), angle, distance)
+
+    def nearest(self, x, y, allRoutes=False):
+        '''the location of each point on the closest segment within the
+        search radius, or with allRoutes, on the closest segment of each
+        route within the search radius. Ties go to the lower measure. Points
+        farther than the radius from every route are left out. Rows are
+        sorted by point, then by route.'''
+        point, seg = self.candidates(x, y)
+        located = self.measurePairs(x, y, point, seg)
+        keep = located.distance <= self.radius
+        located = Located(*[a[keep] for a in located])
+
+        return closest(located, allRoutes)
+
+
+def closest(located, allRoutes=False):
+    #the first location of each point (or point and route) once sorted by
+    #distance and then measure, in order of point and then route
+    if allRoutes:
+        order = np.lexsort((located.m, located.distance, located.feature, located.point))
+    else:
+        order = np.lexsort((located.m, located.distance, located.point))
+    located = Located(*[a[order] for a in located])
+    first = np.ones(len(order), bool)
+    first[1:] = located.point[1:] != located.point[:-1]
+    if allRoutes:
+        first[1:] |= located.feature[1:] != located.feature[:-1]
+    return Located(*[a[first] for a in located])
+
+
+def locateFeatures(pointLayer, routes, radius, eventTable, routeField='rkey', mField='RouteM',
+                   distanceField=None, angleField=None, allRoutes=False):
+    '''in-process replacement for LocateFeaturesAlongRoutes_lr with point
+    features. Writes a table of the points in pointLayer that are within
+    radius of a route, with their attributes, the key of the route in
+    routeField, the measure in mField, and optionally the signed offset and
+    the tangent angle of the route. There is exactly one event per point,
+    on the closest route (ties to the lower measure), unless allRoutes is
+    True, in which case there is one event for each route within radius.
+    Returns the number of events.'''
+    fields = xsec_lines.editableFields(pointLayer)
+    xy = []
+    atts = []
+    rows = arcpy.da.SearchCursor(pointLayer, fields + ['SHAPE@XY'], spatial_reference=routes.sr)
+    for row in rows:
+        xy.append(row[-1])
+        atts.append(row[:-1])
+    del rows
+    xy = np.array(xy, 'f8').reshape(-1, 2)
+    located = routes.locate(xy[:, 0], xy[:, 1], radius, allRoutes)
+
+    #the event table has the fields of the points plus the event fields
+    outPath, outName = os.path.split(eventTable)
+    if not outPath:
+        outPath = arcpy.env.workspace
+    arcpy.CreateTable_management(outPath, outName, pointLayer)
+    arcpy.AddField_management(eventTable, routeField, 'LONG')
+    arcpy.AddField_management(eventTable, mField, 'DOUBLE')
+    eventFields = [routeField, mField]
+    for f in (distanceField, angleField):
+        if f:
+            arcpy.AddField_management(eventTable, f, 'DOUBLE')
+            eventFields.append(f)
+
+    ids = routes.ids
+    rows = arcpy.da.InsertCursor(eventTable, fields + eventFields)
+    for i in range(len(located.point)):
+        values = [ids[located.feature[i]], float(located.m[i])]
+        if distanceField:
+            values.append(float(located.offset[i]))
+        if angleField:
+            values.append(float(located.angle[i]))
+        rows.insertRow(list(atts[located.point[i]]) + values)
+    del rows
+    return len(located.point)
+
+
+def crossings(p0, p1, a, b):
+    '''every crossing of the segments from p0 to p1 with the edges from a to
+    b. Returns the index of the segment and the parameter (0 to 1) along it
+    of each crossing. Collinear overlaps are not crossings.'''
+    r = p1 - p0
+    e = b - a
+    block = max(1, PAIR_BLOCK // len(p0))
+    segs, ts = [np.zeros(0, int)], [np.zeros(0)]
+    for i in range(0, len(a), block):
+        #segments down the rows, edges across the columns
+        ex, ey = e[i:i + block, 0], e[i:i + block, 1]
+        qx = a[i:i + block, 0] - p0[:, 0:1]
+        qy = a[i:i + block, 1] - p0[:, 1:2]
+        d = r[:, 0:1] * ey - r[:, 1:2] * ex
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (qx * ey - qy * ex) / d
+            u = (qx * r[:, 1:2] - qy * r[:, 0:1]) / d
+        hit = (d != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        row, col = np.nonzero(hit)
+        segs.append(row)
+        ts.append(t[row, col])
+    return np.concatenate(segs), np.concatenate(ts)
+
+
+def insidePolygon(x, y, a, b):
+    #even-odd test of the points x, y against the ring edges from a to b
+    inside = np.zeros(len(x), bool)
+    block = max(1, PAIR_BLOCK // max(len(x), 1))
+    for i in range(0, len(a), block):
+        ax, ay = a[i:i + block, 0], a[i:i + block, 1]
+        bx, by = b[i:i + block, 0], b[i:i + block, 1]
+        spans = (ay > y[:, None]) != (by > y[:, None])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xCross = ax + (y[:, None] - ay) * (bx - ax) / (by - ay)
+        inside ^= (np.sum(spans & (x[:, None] < xCross), axis=1) % 2).astype(bool)
+    return inside
+
+
+def overlayPolygons(polyLayer, routes, eventTable, routeField='rkey', fromField='FromM', toField='ToM'):
+    '''in-process replacement for LocateFeaturesAlongRoutes_lr with polygon
+    features. Writes a table of the intervals of the routes that lie inside
+    the polygons of polyLayer, with the attributes of the polygon, the key of
+    the route in routeField, and the measures in fromField and toField,
+    sorted by route and then by measure. Only the polygons that touch the
+    extent of all the routes are read, selected with the spatial index of
+    the polygons, and of those, polygons whose extent does not overlap the
+    extent of any one route are skipped without reading their rings.
+    Returns the number of events.'''
+    lines = routes.lines
+    xy = lines.coords[:, :2]
+    vf = lines.vertexFeature()
+
+    #the extent of every route, reduced over the run of vertices of each
+    #feature at once
+    starts = np.flatnonzero(np.concatenate(([True], vf[1:] != vf[:-1])))[:len(vf)]
+    if len(starts):
+        boxes = np.column_stack((np.minimum.reduceat(xy, starts), np.maximum.reduceat(xy, starts)))
+    else:
+        boxes = np.zeros((0, 4))
+
+    candidates = polyLayer
+    if len(boxes):
+        #the rectangle around all of the routes; a single north-south or
+        #east-west section has no area, so the diagonal is used instead
+        lo = boxes[:, :2].min(axis=0)
+        hi = boxes[:, 2:].max(axis=0)
+        corners = arcpy.Array([arcpy.Point(lo[0], lo[1]), arcpy.Point(lo[0], hi[1]), arcpy.Point(hi[0], hi[1]),
+                               arcpy.Point(hi[0], lo[1]), arcpy.Point(lo[0], lo[1])])
+        if (hi > lo).all():
+            extent = arcpy.Polygon(corners, routes.sr)
+        else:
+            extent = arcpy.Polyline(corners, routes.sr)
+        candidates = 'xsec_overlay_lyr'
+        arcpy.MakeFeatureLayer_management(polyLayer, candidates)
+        arcpy.SelectLayerByLocation_management(candidates, 'INTERSECT', extent)
+
+    fields = xsec_lines.editableFields(polyLayer)
+    features, fromM, toM, polygons = [], [], [], []
+    atts = []
+    rows = arcpy.da.SearchCursor(candidates, fields + ['SHAPE@'], spatial_reference=routes.sr)
+    for row in rows:
+        shape = row[-1]
+        if shape is None:
+            continue
+        ext = shape.extent
+        if not ((boxes[:, 0] <= ext.XMax) & (boxes[:, 2] >= ext.XMin) &
+                (boxes[:, 1] <= ext.YMax) & (boxes[:, 3] >= ext.YMin)).any():
+            continue
+        rings = [np.array(ring, 'f8')[:, :2] for ring in json.loads(shape.JSON).get('rings', [])]
+        if not rings:
+            continue
+        a = np.vstack([ring[:-1] for ring in rings])
+        b = np.vstack([ring[1:] for ring in rings])
+        f, m0, m1 = routes.overlay(a, b)
+        if len(f):
+            features.append(f)
+            fromM.append(m0)
+            toM.append(m1)
+            polygons.append(np.repeat(len(atts), len(f)))
+            atts.append(row[:-1])
+    del rows
+    if not candidates == polyLayer:
+        arcpy.Delete_management(candidates)
+
+    if features:
+        features, fromM, toM, polygons = [np.concatenate(v) for v in (features, fromM, toM, polygons)]
+    else:
+        features, fromM, toM, polygons = np.zeros(0, int), np.zeros(0), np.zeros(0), np.zeros(0, int)
+    order = np.lexsort((polygons, fromM, features))
+
+    outPath, outName = os.path.split(eventTable)
+    if not outPath:
+        outPath = arcpy.env.workspace
+    arcpy.CreateTable_management(outPath, outName, polyLayer)
+    arcpy.AddField_management(eventTable, routeField, 'LONG')
+    arcpy.AddField_management(eventTable, fromField, 'DOUBLE')
+    arcpy.AddField_management(eventTable, toField, 'DOUBLE')
+
+    ids = routes.ids
+    rows = arcpy.da.InsertCursor(eventTable, fields + [routeField, fromField, toField])
+    for i in order:
+        rows.insertRow(list(atts[polygons[i]]) + [ids[features[i]], float(fromM[i]), float(toM[i])])
+    del rows
+    return len(order)
+
+
+def copyFields(table, fc, fields):
+    #adds fields of table to fc with the same type and length
+    types = {'String': 'TEXT', 'Integer': 'LONG', 'SmallInteger': 'SHORT',
+             'Double': 'DOUBLE', 'Single': 'FLOAT', 'Date': 'DATE', 'GUID': 'GUID'}
+    for f in arcpy.ListFields(table):
+        if f.name in fields:
+            arcpy.AddField_management(fc, f.name, types.get(f.type, 'TEXT'), '#', '#', f.length)
+
+
+def placeEvents(routes, eventTable, routeField, fromField, toField, eventLay):
+    '''in-process replacement for MakeRouteEventLayer_lr with line events.
+    Each row of eventTable is cut out of the route whose key is in routeField
+    between the measures in fromField and toField and written with its
+    attributes to the new feature class eventLay, Z and M enabled as the
+    routes are. Events on routes that do not exist and events that come out
+    with zero length are dropped before any geometry is written. Returns the
+    number of features written.'''
+    fields = xsec_lines.editableFields(eventTable)
+    iRoute, iFrom, iTo = [fields.index(f) for f in (routeField, fromField, toField)]
+    features = dict((key, f) for f, key in enumerate(routes.ids))
+
+    paths = []
+    partFeature = []
+    atts = []
+    rows = arcpy.da.SearchCursor(eventTable, fields)
+    for row in rows:
+        feature = features.get(row[iRoute])
+        if feature is None or row[iFrom] is None or row[iTo] is None:
+            continue
+        parts = routes.slice(feature, row[iFrom], row[iTo])
+        if parts:
+            paths.extend(parts)
+            partFeature.extend([len(atts)] * len(parts))
+            atts.append(tuple(row))
+    del rows
+
+    k = routes.lines.coords.shape[1]
+    counts = [len(path) for path in paths]
+    partStart = np.concatenate(([0], np.cumsum(counts))).astype(int)
+    coords = np.vstack(paths) if paths else np.zeros((0, k))
+    events = xsec_lines.PackedLines(coords, partStart, partFeature, fields, atts)
+
+    outPath, outName = os.path.split(eventLay)
+    if not outPath:
+        outPath = arcpy.env.workspace
+    hasZ = 'ENABLED' if routes.hasZ else 'DISABLED'
+    arcpy.CreateFeatureclass_management(outPath, outName, 'POLYLINE', '#', 'ENABLED', hasZ, routes.sr)
+    copyFields(eventTable, eventLay, fields)
+    xsec_lines.insertLines(eventLay, events, fields, routes.hasZ, True)
+    return events.nFeatures
@@ -0,0 +1,258 @@
+'''
+Name: xsec_transform.py
+Description: functions for transforming the vertices of features in
+    cross-section view as NumPy arrays, e.g. to change the vertical
+    exaggeration of a section package, instead of moving one arcpy Point
+    at a time.
+Requirements: ArcGIS 10.1 or later (arcpy.da and the numpy that ships with it)
+Date: 10/18/26
+
+Usage: import xsec_transform
+
+       shape - an Esri JSON geometry as a dictionary, as read from SHAPE@JSON
+       fn - a function that takes an (n, 4) array of vertex coordinates,
+           columns ordered X, Y, Z, M, and returns the transformed array,
+           e.g. an Affine object
+
+The tools that draw features in cross-section view record the vertical
+exaggeration of each feature in VE_FIELD, and the elevation of each point
+feature in Z_FIELD (lines and polygons keep it in the Z of their vertices),
+so that a section package can be redrawn at another exaggeration from
+those values alone, without going back to the DEM or the routes.
+
+A geometry is transformed by gathering all of its vertices, from every part
+or ring, into one array, handing that to fn, and putting the rows back where
+they came from. Geometries without Z or M get NaN in those columns.
+
+The transforms the tools need - flipping map view profiles to cross-section
+view, rescaling X and Y, and recovering elevations from an exaggerated Y -
+are all affine, so each is one Affine object applied to all of the vertices
+of a geometry in one pass.
+'''
+import json
+import math
+import time
+import numpy as np
+import arcpy
+
+#columns of the coordinate arrays
+X, Y, Z, M = range(4)
+
+#fields recording how a feature was drawn in cross-section view: the
+#vertical exaggeration, and the elevation of a point feature
+VE_FIELD = 'SectionVE'
+Z_FIELD = 'SectionZ'
+
+#fields of structural points that depend on the vertical exaggeration, as
+#written by points2XsecView: ApparentIncVE holds the true apparent
+#inclination, ApparentInclination the exaggerated one the symbol is drawn at
+TRUE_INC_FIELD = 'ApparentIncVE'
+INC_FIELD = 'ApparentInclination'
+ROTATION_FIELD = 'SymbolRotation'
+
+
+class Affine(object):
+    '''an affine transform of XYZM vertex coordinates,
+    new = old . matrix.T + offset
+
+    matrix - (4, 4) array; row i holds the weights of the old X, Y, Z, and M
+        in new column i
+    offset - (4) array added to the new coordinates'''
+    def __init__(self, matrix=None, offset=None):
+        self.matrix = np.eye(4) if matrix is None else np.asarray(matrix, 'f8')
+        self.offset = np.zeros(4) if offset is None else np.asarray(offset, 'f8')
+
+    @classmethod
+    def scale(cls, x=1.0, y=1.0):
+        #multiply X and Y, e.g. by a horizontal and a vertical exaggeration
+        return cls(np.diag([float(x), float(y), 1.0, 1.0]))
+
+    @classmethod
+    def sideView(cls, ve):
+        #map view to cross-section view: X from M and Y from Z times the
+        #vertical exaggeration; Z and M are kept
+        matrix = np.zeros((4, 4))
+        matrix[X, M] = 1.0
+        matrix[Y, Z] = float(ve)
+        matrix[Z, Z] = 1.0
+        matrix[M, M] = 1.0
+        return cls(matrix)
+
+    @classmethod
+    def elevation(cls, ve):
+        #Z from the Y of cross-section view at vertical exaggeration ve
+        matrix = np.eye(4)
+        matrix[Z, Z] = 0.0
+        matrix[Z, Y] = 1.0 / float(ve)
+        return cls(matrix)
+
+    def __call__(self, coords):
+        '''the transformed copy of an (n, 4) array of XYZM coordinates. Each
+        new column only reads the old columns it depends on, so a NaN Z or M
+        does not spread to X and Y.'''
+        coords = np.asarray(coords, 'f8')
+        new = np.empty(coords.shape)
+        for i in range(4):
+            used = np.flatnonzero(self.matrix[i])
+            new[:, i] = np.dot(coords[:, used], self.matrix[i, used]) + self.offset[i]
+        return new
+
+
+def transformShape(shape, fn):
+    '''applies fn to every vertex of a point, multipoint, polyline, or polygon
+    geometry at once. Returns the new geometry and the number of vertices.
+    Empty geometries are returned as they are.'''
+    shape = dict(shape)
+    if 'x' in shape:
+        if shape['x'] is None or shape['x'] == 'NaN':
+            return shape, 0
+        keys = [k for k in ('x', 'y', 'z', 'm') if k in shape]
+        columns = ['xyzm'.index(k) for k in keys]
+        coords = widen(np.array([[shape[k] for k in keys]], 'f8'), columns)
+        shape.update(zip(keys, fn(coords)[0, columns].tolist()))
+        return shape, 1
+
+    for key in ('paths', 'rings', 'points'):
+        if key in shape:
+            break
+    else:
+        return shape, 0
+    groups = [shape[key]] if key == 'points' else shape[key]
+    counts = [len(g) for g in groups]
+    if sum(counts) == 0:
+        return shape, 0
+    columns = [X, Y] + [Z] * bool(shape.get('hasZ')) + [M] * bool(shape.get('hasM'))
+    coords = widen(np.vstack([np.array(g, 'f8') for g in groups if len(g)]), columns)
+    coords = fn(coords)[:, columns]
+    parts = [part.tolist() for part in np.split(coords, np.cumsum(counts)[:-1])]
+    shape[key] = parts[0] if key == 'points' else parts
+    return shape, len(coords)
+
+def widen(coords, columns):
+    #XYZM array with the columns of coords in the given positions and NaN
+    #in the rest
+    full = np.empty((len(coords), 4))
+    full.fill(np.nan)
+    full[:, columns] = coords
+    return full
+
+def transformLayer(layer, fn):
+    '''applies fn to the vertices of every feature in layer, in place, one
+    array per feature. Only the selected features of a layer with a
+    selection are changed. Returns the number of features and vertices.'''
+    nFeatures = 0
+    nVertices = 0
+    rows = arcpy.da.UpdateCursor(layer, ['SHAPE@'])
+    for row in rows:
+        nFeatures += 1
+        if row[0] is None:
+            continue
+        shape, n = transformShape(json.loads(row[0].JSON), fn)
+        if n > 0:
+            rows.updateRow([arcpy.AsShape(shape, True)])
+        nVertices += n
+    del rows
+    return nFeatures, nVertices
+
+def addSectionFields(fc, points=False):
+    '''adds VE_FIELD, and Z_FIELD if points, to fc if they are not there,
+    e.g. to a feature class new features will be appended to'''
+    for field in [VE_FIELD] + [Z_FIELD] * points:
+        if len(arcpy.ListFields(fc, field)) == 0:
+            arcpy.AddField_management(fc, field, 'DOUBLE')
+
+def recordVE(fc, ve):
+    #sets VE_FIELD to ve for every feature in fc, adding it if needed
+    addSectionFields(fc)
+    arcpy.CalculateField_management(fc, VE_FIELD, repr(float(ve)))
+
+def redraw(oldVE, ve, z=None):
+    '''a function for transformShape that draws Y at vertical exaggeration ve
+    from z, the elevation of a point feature, or else from the Z of each
+    vertex. Vertices without a Z are rescaled from Y drawn at oldVE.'''
+    def fn(coords):
+        elevation = coords[:, Z] if z is None else np.ones(len(coords)) * z
+        elevation = np.where(np.isnan(elevation), coords[:, Y] / float(oldVE), elevation)
+        return Affine.scale(1.0, ve)(np.column_stack((coords[:, X], elevation, coords[:, Z:])))
+    return fn
+
+def exaggeratedInclination(trueInc, ve):
+    #the apparent inclination of a structure as drawn at exaggeration ve
+    return math.degrees(math.atan(ve * math.tan(math.radians(trueInc))))
+
+def reexaggerateLayer(layer, ve):
+    '''redraws the features of layer at vertical exaggeration ve from the
+    values recorded when they were drawn, and for structural points,
+    recomputes the exaggerated apparent inclination and the symbol rotation.
+    Features without a recorded exaggeration are left alone. Returns the
+    number of features and vertices redrawn and the seconds it took.'''
+    start = time.time()
+    ve = float(ve)
+    names = [f.name for f in arcpy.ListFields(layer)]
+    if not VE_FIELD in names:
+        return 0, 0, time.time() - start
+    fields = ['SHAPE@', VE_FIELD]
+    hasZ = Z_FIELD in names
+    if hasZ:
+        fields.append(Z_FIELD)
+    orientation = all(f in names for f in (TRUE_INC_FIELD, INC_FIELD, ROTATION_FIELD))
+    if orientation:
+        fields.extend((TRUE_INC_FIELD, INC_FIELD, ROTATION_FIELD))
+
+    nFeatures = 0
+    nVertices = 0
+    rows = arcpy.da.UpdateCursor(layer, fields)
+    for row in rows:
+        oldVE = row[1]
+        if not oldVE:
+            continue
+        if row[0] is not None:
+            z = row[2] if hasZ else None
+            shape, n = transformShape(json.loads(row[0].JSON), redraw(oldVE, ve, z))
+            row[0] = arcpy.AsShape(shape, True)
+            nVertices += n
+        row[1] = ve
+        if orientation and row[-3] is not None and row[-1] is not None:
+            #the symbol is rotated to 360 - inclination or 180 + inclination
+            #depending on which way the structure dips; that doesn't change
+            inc = exaggeratedInclination(row[-3], ve)
+            row[-1] = round(360 - inc if row[-1] >= 270 else 180 + inc, 2)
+            row[-2] = round(inc, 2)
+        rows.updateRow(row)
+        nFeatures += 1
+    del rows
+    return nFeatures, nVertices, time.time() - start
+
+def rescaleLayer(layer, he, ve):
+    '''multiplies X by he and Y by ve for every vertex of the features in
+    layer, and the exaggeration recorded in VE_FIELD by ve if the layer has
+    it. Returns the number of features and vertices and the seconds it
+    took.'''
+    start = time.time()
+    nFeatures, nVertices = transformLayer(layer, Affine.scale(he, ve))
+    #Y is now drawn at ve times the recorded exaggeration, which has to
+    #follow or reexaggerateLayer would redraw from the wrong one
+    if len(arcpy.ListFields(layer, VE_FIELD)) > 0:
+        rows = arcpy.da.UpdateCursor(layer, [VE_FIELD])
+        for row in rows:
+            if row[0]:
+                rows.updateRow([row[0] * float(ve)])
+        del rows
+    return nFeatures, nVertices, time.time() - start
+
+def plan2side(fc, ve):
+    '''flips the Z and M aware lines in fc from map view to cross-section view
+    in place, with Affine.sideView. Returns the number of vertices flipped.'''
+    return transformLayer(fc, Affine.sideView(ve))[1]
+
+def rescaleLayers(layers, he, ve):
+    '''rescales every layer in layers as rescaleLayer does, one after the
+    other. Returns a list of (layer, features, vertices, seconds), in the
+    order of layers.'''
+    return [(layer,) + rescaleLayer(layer, he, ve) for layer in layers]
+
+def reexaggerateLayers(layers, ve):
+    '''redraws every layer in layers at vertical exaggeration ve as
+    reexaggerateLayer does, one after the other. Returns a list of (layer,
+    features, vertices, seconds), in the order of layers.'''
+    return [(layer,) + reexaggerateLayer(layer, ve) for layer in layers]